@@ -0,0 +1,129 @@
+"""
+HTTP client of the Streamlit app for the FastAPI backend.
+
+All calls go through one pooled keep-alive session that is created once per Streamlit server process
+(st.cache_resource), so the TLS connection to the backend is reused across reruns and user sessions.
+Every call has a connect and a read timeout. Connection failures are retried with backoff, as are the
+502/503/504 answers of a backend that is waking up, but only for idempotent methods. Uploads are
+gzip-compressed when that makes them noticeably smaller. Dashboard responses are cached in the user's
+Streamlit session until a save or delete invalidates them.
+"""
+import os
+import gzip
+import requests
+import streamlit as st
+from dotenv import load_dotenv
+from typing import Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.filepost import encode_multipart_formdata
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+# One base URL for every backend call, each area can still be pointed elsewhere
+BACKEND_URL = os.getenv("BACKEND_URL", "https://loan-documents-processing-using-gen-ai.onrender.com").rstrip("/")
+PROCESSING_BACKEND_URL = os.getenv("PROCESSING_BACKEND_URL", BACKEND_URL).rstrip("/")
+SAVE_BACKEND_URL = os.getenv("SAVE_BACKEND_URL", BACKEND_URL).rstrip("/")
+DASHBOARD_BACKEND_URL = os.getenv("DASHBOARD_BACKEND_URL", BACKEND_URL).rstrip("/")
+
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("BACKEND_CONNECT_TIMEOUT_SECONDS", "10"))
+READ_TIMEOUT_SECONDS = float(os.getenv("BACKEND_READ_TIMEOUT_SECONDS", "60"))
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("BACKEND_UPLOAD_TIMEOUT_SECONDS", "300"))
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "3"))
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "10"))
+
+# Scans and JPEGs barely shrink, so an upload is only sent compressed when that saves at least this fraction
+GZIP_UPLOADS = os.getenv("GZIP_UPLOADS", "true").lower() == "true"
+GZIP_MIN_SAVING = float(os.getenv("GZIP_MIN_SAVING", "0.1"))
+
+# Session state keys holding dashboard data, cleared whenever verified data changes
+DASHBOARD_CACHE_KEYS = ("report_kpis", "history_records", "history_exhausted")
+
+RequestErrors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    retry = Retry(
+        total=BACKEND_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        # POSTs create jobs and document versions, so they are only retried when the connection could not be made
+        allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BACKEND_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def request(method: str, base_url: str, path: str, timeout: float = READ_TIMEOUT_SECONDS, **kwargs) -> requests.Response:
+    return get_session().request(method, f"{base_url}{path}", timeout=(CONNECT_TIMEOUT_SECONDS, timeout), **kwargs)
+
+
+def multipart_body(files: list) -> tuple:
+    """The multipart body and headers for ``files`` ([(filename, content, mime type)]), gzip-compressed if it pays off."""
+    body, content_type = encode_multipart_formdata([("files", file) for file in files])
+    headers = {"Content-Type": content_type}
+    if GZIP_UPLOADS:
+        compressed = gzip.compress(body, compresslevel=6)
+        if len(compressed) <= len(body) * (1 - GZIP_MIN_SAVING):
+            body = compressed
+            headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+# --- Processing ---
+
+def submit_application(files: list) -> requests.Response:
+    body, headers = multipart_body(files)
+    return request("POST", PROCESSING_BACKEND_URL, "/applications/", timeout=UPLOAD_TIMEOUT_SECONDS, data=body, headers=headers)
+
+
+def get_application_status(status_url: str) -> requests.Response:
+    return request("GET", PROCESSING_BACKEND_URL, status_url)
+
+
+# --- Verification ---
+
+def save_verified_document(payload: dict) -> requests.Response:
+    response = request("POST", SAVE_BACKEND_URL, "/save-verified-document/", json=payload)
+    invalidate_dashboard_cache()
+    return response
+
+
+def save_verified_application(payload: dict) -> requests.Response:
+    response = request("POST", SAVE_BACKEND_URL, "/save-verified-application/", json=payload)
+    invalidate_dashboard_cache()
+    return response
+
+
+# --- Reporting Dashboard ---
+
+def invalidate_dashboard_cache():
+    for key in DASHBOARD_CACHE_KEYS:
+        st.session_state.pop(key, None)
+
+
+def get_report_kpis() -> Tuple[Optional[dict], Optional[str]]:
+    """The KPIs, or None and the backend's error message. Only the parsed KPIs of a successful answer are kept
+    in the session, so an error is retried on the next rerun."""
+    if "report_kpis" not in st.session_state:
+        response = request("GET", DASHBOARD_BACKEND_URL, "/report-kpis/")
+        if response.status_code != 200:
+            return None, response.text
+        st.session_state.report_kpis = response.json()
+    return st.session_state.report_kpis, None
+
+
+def get_report_history_page(limit: int, after_id: str = None) -> requests.Response:
+    params = {"limit": limit, **({"after_id": after_id} if after_id else {})}
+    return request("GET", DASHBOARD_BACKEND_URL, "/report-history/", params=params)
+
+
+def delete_all_data() -> requests.Response:
+    response = request("DELETE", DASHBOARD_BACKEND_URL, "/delete-all-data/")
+    invalidate_dashboard_cache()
+    return response
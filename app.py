@@ -1,10 +1,15 @@
 import streamlit as st
-import requests
 import json
 import pandas as pd
 import re
 import os
 import uuid
+import time
+import api_client
+
+# Backend URLs, timeouts and retries are configured in api_client (BACKEND_URL)
+STATUS_POLL_SECONDS = 2
+HISTORY_PAGE_SIZE = 200
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -66,7 +71,8 @@ page = st.sidebar.radio(
 st.sidebar.markdown("---")
 st.sidebar.info("This project leverages Generative AI to automate loan document processing, including a human-in-the-loop verification workflow.")
 
-# --- Helper function for the verification form ---
+# --- Helper functions for the verification form ---
+# The fields are plain widgets (not an st.form) so "Save All" can read every document's current values.
 def display_verification_form(doc_data, application_id, unique_key):
     extracted_data = doc_data.get("extracted_data", {})
     filename = doc_data.get("filename", "unknown_file")
@@ -75,41 +81,62 @@ def display_verification_form(doc_data, application_id, unique_key):
         st.warning("No structured data was extracted to verify.")
         return
 
-    with st.form(key=f"verification_form_{unique_key}"):
-        corrected_data = {}
-        for field, details in extracted_data.items():
-            value = details.get('value', '') if isinstance(details, dict) else details
-            confidence = details.get('confidence', 0.0) * 100 if isinstance(details, dict) else 0.0
-
-            help_text = f"Confidence: {confidence:.1f}%"
-            if confidence < 75:
-                help_text = f"⚠️ Low Confidence ({confidence:.1f}%) - Please verify carefully."
-
-            corrected_data[field] = st.text_input(
-                label=f"{field}",
-                value=value,
-                key=f"{unique_key}_{field.lower().replace(' ', '_')}",
-                help=help_text
-            )
-
-        submitted = st.form_submit_button("Approve & Save This Document's Data")
-
-        if submitted:
-            with st.spinner("Saving verified data..."):
-                payload = {
-                    "application_id": application_id,
-                    "filename": filename,
-                    "original_ai_data": doc_data,
-                    "verified_data": corrected_data
-                }
-                try:
-                    save_response = requests.post("https://loan-documents-processing-using-gen-ai.onrender.com", json=payload)
-                    if save_response.status_code == 200:
-                        st.success(f"✅ Verified data for `{filename}` saved successfully!")
-                    else:
-                        st.error(f"Failed to save data for `{filename}`: {save_response.text}")
-                except requests.exceptions.ConnectionError:
-                    st.error("🚫 Connection Error: Could not connect to the backend to save data.")
+    for field, details in extracted_data.items():
+        value = details.get('value', '') if isinstance(details, dict) else details
+        confidence = details.get('confidence', 0.0) * 100 if isinstance(details, dict) else 0.0
+
+        help_text = f"Confidence: {confidence:.1f}%"
+        if confidence < 75:
+            help_text = f"⚠️ Low Confidence ({confidence:.1f}%) - Please verify carefully."
+
+        st.text_input(
+            label=f"{field}",
+            value=value,
+            key=f"{unique_key}_{field.lower().replace(' ', '_')}",
+            help=help_text
+        )
+
+    if st.button("Approve & Save This Document's Data", key=f"save_{unique_key}"):
+        with st.spinner("Saving verified data..."):
+            payload = {
+                "application_id": application_id,
+                "filename": filename,
+                "original_ai_data": doc_data,
+                "verified_data": collect_verified_data(doc_data, unique_key)
+            }
+            try:
+                save_response = api_client.save_verified_document(payload)
+                if save_response.status_code == 200:
+                    st.success(f"✅ Verified data for `{filename}` saved successfully!")
+                else:
+                    st.error(f"Failed to save data for `{filename}`: {save_response.text}")
+            except api_client.RequestErrors:
+                st.error("🚫 Connection Error: Could not connect to the backend to save data.")
+
+def collect_verified_data(doc_data, unique_key):
+    corrected_data = {}
+    for field, details in doc_data.get("extracted_data", {}).items():
+        value = details.get('value', '') if isinstance(details, dict) else details
+        corrected_data[field] = str(st.session_state.get(f"{unique_key}_{field.lower().replace(' ', '_')}", value) or "")
+    return corrected_data
+
+def save_all_verified_documents(doc_results, application_id):
+    documents = [
+        {"filename": doc.get("filename", "unknown_file"), "original_ai_data": doc, "verified_data": collect_verified_data(doc, f"doc_{i}")}
+        for i, doc in enumerate(doc_results) if doc.get("extracted_data") and not doc.get("error")
+    ]
+    if not documents:
+        st.warning("No structured data was extracted to verify.")
+        return
+    with st.spinner(f"Saving verified data for {len(documents)} documents..."):
+        try:
+            save_response = api_client.save_verified_application({"application_id": application_id, "documents": documents})
+            if save_response.status_code == 200:
+                st.success(f"✅ Verified data for all {len(documents)} documents saved successfully!")
+            else:
+                st.error(f"Failed to save the application's verified data: {save_response.text}")
+        except api_client.RequestErrors:
+            st.error("🚫 Connection Error: Could not connect to the backend to save data.")
 
 # --- Page 1: Loan Application Processor ---
 if page == "Loan Application Processor":
@@ -142,23 +169,41 @@ if page == "Loan Application Processor":
         if st.button("Process Full Application", type="primary", disabled=st.session_state.processing):
             st.session_state.processing = True
             st.info(f"✨ Processing {len(uploaded_files)} documents...")
-            with st.spinner('AI is analyzing the application... This may take some time.'):
-                multipart_files = [('files', (file.name, file.getvalue(), file.type)) for file in uploaded_files]
-                try:
-                    response = requests.post("https://loan-documents-processing-using-gen-ai-2igp.onrender.com", files=multipart_files)
-                    if response.status_code == 200:
-                        st.success('✅ Application processed successfully!')
-                        st.session_state.application_results = response.json()
-                    else:
-                        try:
-                            error_detail = response.json().get('detail', response.text)
-                        except json.JSONDecodeError:
-                            error_detail = response.text
-                        st.error(f"❌ Error from server ({response.status_code}): {error_detail}")
-                        st.session_state.application_results = None
-                except requests.exceptions.ConnectionError:
-                    st.error("🚫 Connection Error: Could not connect to the backend.")
+            multipart_files = [(file.name, file.getvalue(), file.type) for file in uploaded_files]
+            try:
+                # Submit returns immediately, then we poll the job so no request is held open for the whole pipeline
+                submit_response = api_client.submit_application(multipart_files)
+                if submit_response.status_code in (200, 202):
+                    job = submit_response.json()
+                    progress_bar = st.progress(0.0, text="Waiting for the AI to start on this application...")
+                    while True:
+                        status_response = api_client.get_application_status(job['status_url'])
+                        if status_response.status_code != 200:
+                            st.error(f"❌ Lost track of the application ({status_response.status_code}): {status_response.text}")
+                            st.session_state.application_results = None
+                            break
+                        job_status = status_response.json()
+                        finished, total = job_status['documents_finished'], job_status['documents_total']
+                        progress_bar.progress(finished / total if total else 1.0, text=f"AI is analyzing the application... {finished}/{total} documents processed")
+                        if job_status['status'] == 'completed':
+                            st.success('✅ Application processed successfully!')
+                            st.session_state.application_results = job_status['result']
+                            break
+                        if job_status['status'] == 'failed':
+                            st.error(f"❌ Error from server: {job_status['error']}")
+                            st.session_state.application_results = None
+                            break
+                        time.sleep(STATUS_POLL_SECONDS)
+                else:
+                    try:
+                        error_detail = submit_response.json().get('detail', submit_response.text)
+                    except json.JSONDecodeError:
+                        error_detail = submit_response.text
+                    st.error(f"❌ Error from server ({submit_response.status_code}): {error_detail}")
                     st.session_state.application_results = None
+            except api_client.RequestErrors:
+                st.error("🚫 Connection Error: Could not connect to the backend.")
+                st.session_state.application_results = None
             st.session_state.processing = False
             st.rerun() # Rerun to update the button state
 
@@ -210,13 +255,18 @@ if page == "Loan Application Processor":
 
         st.markdown("---")
         st.subheader("📄 Individual Document Verification")
-        st.info("Review each document below. You can correct the data and save it individually.")
+        st.info("Review each document below. You can correct the data and save it individually, or save every document at once at the bottom.")
 
-        for i, doc_result in enumerate(results.get('individual_document_results', [])):
+        doc_results = results.get('individual_document_results', [])
+        for i, doc_result in enumerate(doc_results):
             doc_type = doc_result.get('document_type', 'Unknown')
             filename = doc_result.get('filename', 'N/A')
 
             with st.expander(f"**{doc_type}**: `{filename}`"):
+                if doc_result.get('error'):
+                    st.error(f"❌ This document could not be processed: {doc_result['error']}")
+                    continue
+
                 col1_doc, col2_doc = st.columns(2)
                 with col1_doc:
                     display_verification_form(doc_result, application_id, unique_key=f"doc_{i}")
@@ -232,96 +282,88 @@ if page == "Loan Application Processor":
                 if st.checkbox("View Full Raw Data (for debugging)", key=f"raw_data_checkbox_{i}"):
                     st.json(doc_result)
 
-# --- Page 2: Reporting Dashboard (Refactored for MongoDB) ---
+        if st.button("Approve & Save All Documents", type="primary"):
+            save_all_verified_documents(doc_results, application_id)
+
+# --- Page 2: Reporting Dashboard (KPIs and history are computed/paginated by the backend) ---
 elif page == "Reporting Dashboard":
     st.title("📊 Reporting Dashboard")
     st.markdown("---")
 
-    try:
-        # Fetches data from the new MongoDB endpoint
-        response = requests.get("http://127.0.0.1:8000/get-report-data/")
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                records = []
-                for item in data:
-                    # --- CHANGE: Add 'is_active' status to the record ---
-                    flat_record = {
-                        "is_active": item.get("is_active"),
-                        "application_id": item["application_id"],
-                        "filename": item["filename"]
-                    }
-
-                    # Safely access ai_data and verified_data
-                    for key, val in item.get("ai_data", {}).items():
-                        flat_record[f"ai_{key.replace(' ', '_').lower()}"] = val.get("value") if isinstance(val, dict) else val
-                    for key, val in item.get("verified_data", {}).items():
-                        flat_record[f"verified_{key.replace(' ', '_').lower()}"] = val
-                    records.append(flat_record)
-
-                df = pd.DataFrame(records)
-                
-                # --- CHANGE: Only calculate metrics on active documents ---
-                active_df = df[df['is_active'] == True]
+    # KPIs and history are kept for this session until data is saved or deleted, or the user refreshes
+    if st.button("Refresh dashboard"):
+        api_client.invalidate_dashboard_cache()
 
+    try:
+        kpis, kpi_error = api_client.get_report_kpis()
+        if kpis is not None:
+            if kpis['total_active_documents']:
                 st.subheader("Key Performance Indicators (Based on Active Documents)")
-                total_fields, matching_fields = 0, 0
-                
-                verified_cols = [col for col in active_df.columns if col.startswith('verified_')]
-                fields_to_check = [col.replace('verified_', '') for col in verified_cols]
-
-                for field in fields_to_check:
-                    ai_col, verified_col = f"ai_{field}", f"verified_{field}"
-                    if ai_col in active_df.columns and verified_col in active_df.columns:
-                        df_subset = active_df.dropna(subset=[ai_col, verified_col]).copy()
-                        
-                        # --- FIX: Explicitly convert columns to string before comparison ---
-                        df_subset[ai_col] = df_subset[ai_col].astype(str)
-                        df_subset[verified_col] = df_subset[verified_col].astype(str)
-
-                        comparison = df_subset[ai_col].str.strip().str.lower() == df_subset[verified_col].str.strip().str.lower()
-                        matching_fields += comparison.sum()
-                        total_fields += len(df_subset)
-
-                ai_accuracy = (matching_fields / total_fields) * 100 if total_fields > 0 else 0
-                total_docs = len(active_df)
-
-                avg_income_col = next((col for col in ['verified_gross_income', 'verified_total_income'] if col in active_df.columns), None)
-                avg_income = pd.to_numeric(active_df[avg_income_col], errors='coerce').mean() if avg_income_col else None
-                
-                avg_taxes_col = next((col for col in ['verified_total_taxes', 'verified_taxes_paid'] if col in active_df.columns), None)
-                avg_taxes = pd.to_numeric(active_df[avg_taxes_col], errors='coerce').mean() if avg_taxes_col else None
+                avg_income = kpis.get('average_income')
+                avg_taxes = kpis.get('average_taxes')
 
                 col1, col2, col3, col4 = st.columns(4)
-                col1.metric("Total Active Docs", f"{total_docs}")
+                col1.metric("Total Active Docs", f"{kpis['total_active_documents']}")
                 col2.metric("Avg. Gross Income", f"₹{avg_income:,.2f}" if avg_income else "N/A")
                 col3.metric("Avg. Total Taxes", f"₹{avg_taxes:,.2f}" if avg_taxes else "N/A")
-                col4.metric("AI Accuracy", f"{ai_accuracy:.2f}%")
+                col4.metric("AI Accuracy", f"{kpis['ai_accuracy']:.2f}%")
+
+                if kpis['per_field_accuracy']:
+                    with st.expander("AI Accuracy by Field"):
+                        st.dataframe(pd.DataFrame(kpis['per_field_accuracy']).set_index('field'))
 
                 st.markdown("---")
                 st.subheader("Complete Data History")
                 st.info("This table shows all verified documents, including older, inactive versions.")
-                st.dataframe(df)
+
+                # History is fetched one page at a time, older pages are appended on request
+                if 'history_records' not in st.session_state:
+                    st.session_state.history_records = []
+                    st.session_state.history_exhausted = False
+                if (not st.session_state.history_records and not st.session_state.history_exhausted) or st.session_state.get('load_more_history'):
+                    after_id = st.session_state.history_records[-1]['_id'] if st.session_state.history_records else None
+                    history_response = api_client.get_report_history_page(HISTORY_PAGE_SIZE, after_id)
+                    if history_response.status_code == 200:
+                        page_records = [json.loads(line) for line in history_response.iter_lines() if line]
+                        st.session_state.history_records.extend(page_records)
+                        st.session_state.history_exhausted = len(page_records) < HISTORY_PAGE_SIZE
+                    else:
+                        st.error(f"Failed to fetch report history from the backend: {history_response.text}")
+
+                records = []
+                for item in st.session_state.history_records:
+                    flat_record = {
+                        "is_active": item.get("is_active"),
+                        "application_id": item.get("application_id"),
+                        "filename": item.get("filename")
+                    }
+                    for key, val in (item.get("ai_data") or {}).items():
+                        flat_record[f"ai_{key.replace(' ', '_').lower()}"] = val
+                    for key, val in (item.get("verified_data") or {}).items():
+                        flat_record[f"verified_{key.replace(' ', '_').lower()}"] = val
+                    records.append(flat_record)
+                st.dataframe(pd.DataFrame(records))
+                if not st.session_state.history_exhausted:
+                    st.button("Load older records", key="load_more_history")
 
                 st.markdown("---")
                 st.subheader("Manage Data")
                 if st.checkbox("I want to permanently delete all verified data."):
                     if st.button("Delete All Data", type="primary", help="This action cannot be undone."):
                         try:
-                            # Calls the correct delete endpoint
-                            delete_response = requests.delete("http://127.0.0.1:8000/delete-all-data/")
+                            delete_response = api_client.delete_all_data()
                             if delete_response.status_code == 200:
                                 st.success("All verified data has been deleted successfully.")
                                 st.rerun()
                             else:
                                 st.error(f"Failed to delete data: {delete_response.text}")
-                        except requests.exceptions.ConnectionError:
+                        except api_client.RequestErrors:
                             st.error("🚫 Connection Error.")
             else:
                 st.warning("No verified data found in the database.")
         else:
-            st.error(f"Failed to fetch report data from the backend: {response.text}")
-    except requests.exceptions.ConnectionError:
+            st.error(f"Failed to fetch report data from the backend: {kpi_error}")
+    except api_client.RequestErrors:
         st.error("🚫 Connection Error: Could not connect to the backend.")
     except Exception as e:
         st.error(f"An unexpected error occurred while loading the dashboard: {e}")
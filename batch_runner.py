@@ -0,0 +1,254 @@
+"""
+Batch runner for backfilling loan packages without going through the API.
+
+Every package goes through the same pipeline as POST /process-application/ (process_single_file for each
+document, then cross-validation and the final summary), with package-level and document-level parallelism.
+Results are streamed to a JSONL file or upserted into MongoDB in bulk. Finished packages are recorded in a
+checkpoint file, so re-running the same command after a crash skips them.
+
+Packages come from either
+  * a directory whose sub-directories are packages (the sub-directory name is the application ID), or
+  * a JSONL manifest with one package per line: {"application_id": "APP-1", "files": ["a.pdf", "b.png"]}
+    (relative paths are resolved against the manifest's directory).
+
+Usage:
+    python batch_runner.py --input packages/ --output results.jsonl --packages 4 --documents 2
+    python batch_runner.py --manifest manifest.jsonl --mongo --collection batch_results
+    python batch_runner.py --input packages/ --output results.jsonl --retry-failed
+
+Output is written at least once: a package that finished but was not checkpointed before a crash is
+processed again, which appends a second JSONL line (MongoDB records are upserted by application ID).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+from pymongo import ReplaceOne
+
+import main
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+
+
+class Package:
+    def __init__(self, application_id: str, files: List[str]):
+        self.application_id = application_id
+        self.files = files
+
+
+def packages_from_directory(input_dir: str) -> Iterator[Package]:
+    for name in sorted(os.listdir(input_dir)):
+        package_dir = os.path.join(input_dir, name)
+        if name.startswith(".") or not os.path.isdir(package_dir):
+            continue
+        files = [os.path.join(package_dir, filename) for filename in sorted(os.listdir(package_dir)) if not filename.startswith(".")]
+        yield Package(name, [path for path in files if os.path.isfile(path)])
+
+
+def packages_from_manifest(manifest_path: str) -> Iterator[Package]:
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            files = [path if os.path.isabs(path) else os.path.join(base_dir, path) for path in entry["files"]]
+            yield Package(str(entry.get("application_id") or f"{os.path.basename(manifest_path)}:{line_number}"), files)
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished packages, read back on start to skip them."""
+
+    def __init__(self, path: str, retry_failed: bool):
+        self.path = path
+        self.finished = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry["status"] == "done" or not retry_failed:
+                        self.finished.add(entry["application_id"])
+                    else:
+                        self.finished.discard(entry["application_id"])
+        self._file = open(path, "a")
+
+    def record(self, application_id: str, status: str, error: Optional[str] = None):
+        entry = {"application_id": application_id, "status": status, "finished_at": datetime.now(timezone.utc).isoformat()}
+        if error:
+            entry["error"] = error
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlSink:
+    def __init__(self, path: str):
+        self._file = open(path, "a")
+
+    async def write(self, record: dict) -> List[dict]:
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+        return [record]
+
+    async def flush(self) -> List[dict]:
+        return []
+
+    def close(self):
+        self._file.close()
+
+
+class MongoSink:
+    """Buffers records and upserts them by application ID in one bulk write per batch."""
+
+    def __init__(self, collection, batch_size: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.buffer = []
+
+    async def write(self, record: dict) -> List[dict]:
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            return await self.flush()
+        return []
+
+    async def flush(self) -> List[dict]:
+        records, self.buffer = self.buffer, []
+        if records:
+            await self.collection.bulk_write([ReplaceOne({"_id": record["application_id"]}, record, upsert=True) for record in records], ordered=False)
+        return records
+
+    def close(self):
+        pass
+
+
+def spooled_uploads_for(package: Package) -> List[main.SpooledUpload]:
+    # The files are already on disk, so they are handed to the pipeline in place instead of being copied
+    uploads = []
+    for path in package.files:
+        filename = os.path.basename(path).lower()
+        if filename.endswith(SUPPORTED_EXTENSIONS):
+            uploads.append(main.SpooledUpload(filename, path, main.hash_file(path), os.path.getsize(path)))
+        else:
+            uploads.append(main.SpooledUpload(filename, path, "", 0))
+    return uploads
+
+
+class BatchRunner:
+    def __init__(self, args, sink, checkpoint: Checkpoint):
+        self.args = args
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    def packages(self) -> Iterator[Package]:
+        source = packages_from_manifest(self.args.manifest) if self.args.manifest else packages_from_directory(self.args.input)
+        for package in source:
+            if package.application_id in self.checkpoint.finished:
+                self.skipped += 1
+                continue
+            yield package
+
+    def settle(self, written: List[dict]):
+        # A package only counts as finished once its record has reached the output
+        for record in written:
+            self.checkpoint.record(record["application_id"], record["batch_status"], record.get("batch_error"))
+
+    async def process(self, package: Package):
+        started = time.perf_counter()
+        record = {"application_id": package.application_id, "source_files": package.files}
+        try:
+            if not package.files:
+                raise ValueError("The package has no files.")
+            uploads = await asyncio.to_thread(spooled_uploads_for, package)
+            result = await main.run_application_pipeline(package.application_id, uploads, include_timings=self.args.timings)
+            record.update(result)
+            succeeded = any("error" not in res for res in result["individual_document_results"])
+            record["batch_status"] = "done" if succeeded else "failed"
+            if not succeeded:
+                record["batch_error"] = "No document of the package could be processed."
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            record.update({"batch_status": "failed", "batch_error": str(detail)})
+        record["processed_at"] = datetime.now(timezone.utc)
+
+        status = record["batch_status"]
+        self.processed += 1
+        self.failed += status == "failed"
+        documents = record.get("individual_document_results") or []
+        print(
+            f"[{self.processed}] {package.application_id}: {status} in {time.perf_counter() - started:.1f}s "
+            f"({len(documents)} documents, {sum('error' in res for res in documents)} with errors)"
+            + (f" - {record['batch_error']}" if record.get("batch_error") else ""),
+            file=sys.stderr
+        )
+        self.settle(await self.sink.write(record))
+
+    async def worker(self, packages: Iterator[Package]):
+        for package in packages:
+            await self.process(package)
+
+    async def run(self):
+        main.MAX_CONCURRENT_FILES = self.args.documents
+        # Without MongoDB the extraction cache stays in memory and results can only go to a JSONL file
+        if main.MONGO_DETAILS:
+            await main.ensure_database()
+            await main.create_indexes()
+        try:
+            # The workers share one iterator, so packages are read lazily and each is taken by exactly one worker
+            packages = self.packages()
+            await asyncio.gather(*(self.worker(packages) for _ in range(max(1, self.args.packages))))
+            self.settle(await self.sink.flush())
+        finally:
+            main.shutdown_raster_pool()
+        elapsed = time.perf_counter() - self.started
+        print(f"Processed {self.processed} packages ({self.failed} failed) in {elapsed:.1f}s, skipped {self.skipped} already finished.", file=sys.stderr)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Process a directory or manifest of loan packages through the document pipeline.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directory whose sub-directories are packages")
+    source.add_argument("--manifest", help="JSONL manifest, one {\"application_id\", \"files\"} package per line")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="Append one JSON line per package to this file")
+    output.add_argument("--mongo", action="store_true", help="Upsert one record per package into MongoDB (MONGO_DETAILS)")
+    parser.add_argument("--collection", default="batch_results", help="MongoDB collection for --mongo")
+    parser.add_argument("--mongo-batch-size", type=int, default=50, help="Records per MongoDB bulk write")
+    parser.add_argument("--packages", type=int, default=2, help="Packages processed at the same time")
+    parser.add_argument("--documents", type=int, default=main.MAX_CONCURRENT_FILES, help="Documents of one package processed at the same time")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: next to the output, or batch_<collection>.checkpoint)")
+    parser.add_argument("--retry-failed", action="store_true", help="Process packages that failed in an earlier run again")
+    parser.add_argument("--timings", action="store_true", help="Include the per-stage timings in each record")
+    args = parser.parse_args()
+
+    if args.input and not os.path.isdir(args.input):
+        sys.exit(f"{args.input} is not a directory")
+    if args.mongo:
+        if not main.MONGO_DETAILS:
+            sys.exit("--mongo needs the MONGO_DETAILS environment variable")
+        main.init_database()
+    checkpoint_path = args.checkpoint or (f"{args.output}.checkpoint" if args.output else f"batch_{args.collection}.checkpoint")
+    checkpoint = Checkpoint(checkpoint_path, args.retry_failed)
+    sink = JsonlSink(args.output) if args.output else MongoSink(main.db.get_collection(args.collection), max(1, args.mongo_batch_size))
+    try:
+        asyncio.run(BatchRunner(args, sink, checkpoint).run())
+    finally:
+        sink.close()
+        checkpoint.close()
+
+
+if __name__ == "__main__":
+    main_cli()
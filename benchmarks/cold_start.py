@@ -0,0 +1,199 @@
+"""
+Cold start benchmark of the API's entry point, `uvicorn main:app` as started by the Procfile and the Dockerfile.
+
+Every run starts a fresh uvicorn process and measures
+  * the import time of main in a fresh interpreter (measured separately, without uvicorn),
+  * the time until the port answers HTTP, which is when a platform can route the first request,
+  * the time until GET /ready reports the instance warm (model SDK loaded, MongoDB connected, indexes created),
+  * the resident memory of the server when it starts listening and when it is ready.
+With --baseline-ref the same is measured on another commit (exported with git archive), e.g. the commit
+before a start-up change, and both are printed side by side.
+
+Usage:
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py --runs 5 --baseline-ref HEAD~1 --json-out cold_start.json
+
+Configuration comes from the environment and .env like in production. MONGO_DETAILS must point at a reachable
+server for /ready to report ready (--mongo-url overrides it); without one the database part of the warm-up keeps
+failing, and the time to ready is reported as not reached. GOOGLE_API_KEY defaults to a placeholder, no model
+call is made.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tarfile
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int):
+    # Linux only; None elsewhere
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def http_get(url: str, timeout: float):
+    """The status code and JSON body of a GET, or None when nothing answers."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b"null")
+        except ValueError:
+            return e.code, None
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+    except ValueError:
+        return 200, None
+
+
+def measure_import(source_dir: str, env: dict) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=source_dir, env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def measure_server(source_dir: str, env: dict, ready_timeout: float) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=source_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    run = {"listen_seconds": None, "ready_seconds": None, "ready_status": None, "listen_rss_mb": None, "ready_rss_mb": None}
+    try:
+        # Any HTTP answer (404 included) means the port is bound and the app is serving
+        while time.perf_counter() - started < ready_timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode}: {server.stderr.read()[-2000:]}")
+            if http_get(f"{base_url}/", timeout=0.5) is not None:
+                run["listen_seconds"] = round(time.perf_counter() - started, 3)
+                run["listen_rss_mb"] = rss_mb(server.pid)
+                break
+            time.sleep(0.01)
+        if run["listen_seconds"] is None:
+            return run
+
+        # /ready waits for the warm-up itself (up to READY_TIMEOUT_SECONDS); an older commit without it answers 404
+        while time.perf_counter() - started < ready_timeout:
+            answer = http_get(f"{base_url}/ready", timeout=ready_timeout)
+            if answer is None:
+                break
+            status_code, body = answer
+            run["ready_status"] = body if isinstance(body, dict) else status_code
+            if status_code == 200:
+                run["ready_seconds"] = round(time.perf_counter() - started, 3)
+                run["ready_rss_mb"] = rss_mb(server.pid)
+                break
+            if status_code == 404:
+                run["ready_status"] = "no /ready endpoint"
+                break
+            time.sleep(0.2)
+        return run
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def export_ref(ref: str, directory: str) -> str:
+    archive = subprocess.run(["git", "archive", ref], cwd=ROOT, capture_output=True, check=True).stdout
+    with tempfile.TemporaryFile() as f:
+        f.write(archive)
+        f.seek(0)
+        with tarfile.open(fileobj=f) as tar:
+            tar.extractall(directory)
+    return directory
+
+
+def summarise(values: list):
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 3), "min": round(min(values), 3), "max": round(max(values), 3), "runs": len(values)}
+
+
+def benchmark(label: str, source_dir: str, env: dict, runs: int, ready_timeout: float) -> dict:
+    print(f"{label}: measuring {runs} cold starts...", file=sys.stderr)
+    imports = [measure_import(source_dir, env) for _ in range(runs)]
+    servers = [measure_server(source_dir, env, ready_timeout) for _ in range(runs)]
+    return {
+        "label": label,
+        "import_seconds": summarise(imports),
+        "listen_seconds": summarise([run["listen_seconds"] for run in servers]),
+        "ready_seconds": summarise([run["ready_seconds"] for run in servers]),
+        "listen_rss_mb": summarise([run["listen_rss_mb"] for run in servers]),
+        "ready_rss_mb": summarise([run["ready_rss_mb"] for run in servers]),
+        "last_ready_status": servers[-1]["ready_status"]
+    }
+
+
+def format_stat(stat, unit: str) -> str:
+    if stat is None:
+        return "not reached"
+    digits = 3 if unit == "s" else 1
+    return f"{stat['median']:.{digits}f}{unit} (min {stat['min']:.{digits}f}, max {stat['max']:.{digits}f})"
+
+
+def print_report(results: list):
+    rows = [("Import of main", "import_seconds", "s"), ("Port answering", "listen_seconds", "s"), ("Ready", "ready_seconds", "s"),
+            ("RSS listening", "listen_rss_mb", " MB"), ("RSS ready", "ready_rss_mb", " MB")]
+    for result in results:
+        print(f"\n{result['label']}")
+        for title, key, unit in rows:
+            print(f"  {title:<16} {format_stat(result[key], unit)}")
+        if result["ready_seconds"] is None:
+            print(f"  /ready           {json.dumps(result['last_ready_status'])}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the API's uvicorn entry point.")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per source tree")
+    parser.add_argument("--baseline-ref", help="Also measure this git commit, e.g. HEAD~1")
+    parser.add_argument("--mongo-url", help="MONGO_DETAILS for the measured servers")
+    parser.add_argument("--ready-timeout", type=float, default=60.0, help="Seconds to wait for the port and for /ready")
+    parser.add_argument("--json-out", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "fake")
+    if args.mongo_url:
+        env["MONGO_DETAILS"] = args.mongo_url
+
+    results = [benchmark("Working tree", ROOT, env, args.runs, args.ready_timeout)]
+    if args.baseline_ref:
+        with tempfile.TemporaryDirectory() as directory:
+            results.append(benchmark(args.baseline_ref, export_ref(args.baseline_ref, directory), env, args.runs, args.ready_timeout))
+    print_report(results)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
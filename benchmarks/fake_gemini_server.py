@@ -0,0 +1,94 @@
+"""
+Local stand-in for the Gemini REST API, for exercising the model call scheduler and load tests
+without a quota or an API key.
+
+It answers generateContent calls with canned but well-formed responses for each prompt the API
+sends (classification, extraction, cross-validation and summary), after a configurable latency,
+and injects 429/503 errors at a configurable rate.
+
+Usage:
+    python benchmarks/fake_gemini_server.py --port 8090 --latency 0.5 --error-rate 0.1
+    GEMINI_BASE_URL=http://127.0.0.1:8090 GOOGLE_API_KEY=fake uvicorn main:app
+"""
+import json
+import random
+import asyncio
+import argparse
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Gemini API")
+settings = {"latency": 0.5, "jitter": 0.2, "error_rate": 0.0}
+counters = {"requests": 0, "errors": 0}
+
+EXTRACTION_DATA = {
+    "Applicant Name": {"value": "Ravi Kumar", "confidence": 0.97},
+    "Name": {"value": "RAVI KUMAR", "confidence": 0.96},
+    "Date of Birth": {"value": "14/08/1990", "confidence": 0.93},
+    "Gross Income": {"value": "85000", "confidence": 0.91},
+    "Total Taxes": {"value": "9200", "confidence": 0.88},
+}
+
+
+def answer_for(prompt: str, schema_fields: list) -> str:
+    if "document classifier" in prompt:
+        return random.choice(["Payslip", "PAN Card", "Aadhaar Card", "Bank Statement"])
+    if "cross-validation" in prompt or "undecided comparisons" in prompt:
+        return json.dumps({"overall_summary": "Name and date of birth are consistent across documents.", "validation_passed": True})
+    if "lead AI underwriter" in prompt:
+        return json.dumps({
+            "overall_summary": "Stable salaried income with consistent identity documents. Documentation quality is good.",
+            "key_financial_metrics": ["Gross Income: 85000", "Total Taxes: 9200"],
+            "consolidated_red_flags": [],
+            "final_recommendation": "Approve"
+        })
+    # With a response schema, answer exactly the fields it asks for
+    extracted_data = {field: EXTRACTION_DATA.get(field, {"value": f"Sample {field}", "confidence": 0.85}) for field in schema_fields} if schema_fields else EXTRACTION_DATA
+    result = {"extracted_data": extracted_data, "analysis": {"red_flags": [], "notes": "Synthetic response from the fake model server."}}
+    if "First identify the type" in prompt:
+        result["document_type"] = "Payslip"
+    return json.dumps(result)
+
+
+@app.post("/{api_version}/models/{model_and_method:path}")
+async def generate_content(api_version: str, model_and_method: str, request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    await asyncio.sleep(max(0.0, settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"])))
+
+    if random.random() < settings["error_rate"]:
+        counters["errors"] += 1
+        code, status = random.choice([(429, "RESOURCE_EXHAUSTED"), (503, "UNAVAILABLE")])
+        return JSONResponse(status_code=code, content={"error": {"code": code, "message": "Injected failure from the fake model server.", "status": status}})
+
+    parts = [part for content in body.get("contents", []) for part in content.get("parts", [])]
+    prompt = " ".join(part.get("text", "") for part in parts)
+    image_count = sum(1 for part in parts if "inlineData" in part or "inline_data" in part or "fileData" in part)
+    generation_config = body.get("generationConfig") or body.get("generation_config") or {}
+    schema = generation_config.get("responseJsonSchema") or generation_config.get("response_json_schema") or {}
+    schema_fields = list(schema.get("properties", {}).get("extracted_data", {}).get("properties", {}))
+    text = answer_for(prompt, schema_fields)
+    prompt_tokens = len(prompt) // 4 + image_count * 258
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": len(text) // 4, "totalTokenCount": prompt_tokens + len(text) // 4},
+        "modelVersion": model_and_method.split(":")[0]
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake of the Gemini generateContent API.")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds each call takes")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with 429/503")
+    args = parser.parse_args()
+    settings.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
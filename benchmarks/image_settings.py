@@ -0,0 +1,122 @@
+"""
+Compares image pipeline settings on a folder of sample documents.
+
+For every setting it reports the payload size sent to the model and the time spent
+rasterising + encoding. With --with-model it also runs classification and extraction
+through the API's own prompts and scores the extracted fields against a ground truth file.
+
+Usage:
+    python benchmarks/image_settings.py --documents samples/
+    python benchmarks/image_settings.py --documents samples/ --ground-truth samples/truth.json --with-model
+
+The ground truth file maps each filename to the expected field values, e.g.
+    {"pan.png": {"Name": "RAVI KUMAR", "PAN Number": "ABCDE1234F"}}
+"""
+import os
+import sys
+import io
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from pdf2image import convert_from_bytes
+from fastapi import HTTPException
+from langchain_core.messages import HumanMessage
+
+import main
+
+def describe(profile: dict) -> str:
+    colour = "gray" if profile.get("grayscale") else "color"
+    quality = f"-q{profile['quality']}" if profile.get("format", "JPEG").upper() != "PNG" else ""
+    max_side = f"-{profile['max_side']}" if profile.get("max_side") else ""
+    return f"{profile.get('format', 'JPEG').lower()}-{profile['dpi']}dpi-{colour}{quality}{max_side}"
+
+
+# The unprocessed baseline, every profile the API currently uses (including IMAGE_PROFILES overrides from the
+# environment), then candidate settings to compare them against
+ORIGINAL = {"dpi": 200, "max_side": None, "grayscale": False, "format": "PNG"}
+CANDIDATES = [
+    {"dpi": 150, "max_side": 1600, "grayscale": False, "format": "JPEG", "quality": 85},
+    {"dpi": 150, "max_side": 1600, "grayscale": True, "format": "WEBP", "quality": 75},
+    {"dpi": 100, "max_side": 1024, "grayscale": True, "format": "JPEG", "quality": 70},
+]
+SETTINGS = {f"{describe(ORIGINAL)} (original)": ORIGINAL}
+SETTINGS.update({f"{name} profile": profile for name, profile in main.IMAGE_PROFILES.items()})
+SETTINGS.update({describe(profile): profile for profile in CANDIDATES if profile not in main.IMAGE_PROFILES.values()})
+
+
+def encode_document(file_content: bytes, filename: str, profile: dict) -> list:
+    if filename.endswith('.pdf'):
+        pages = convert_from_bytes(file_content, dpi=profile["dpi"])
+    else:
+        pages = [Image.open(io.BytesIO(file_content))]
+    return [main.encode_page(page, profile) for page in pages]
+
+
+def normalise(value) -> str:
+    return " ".join(str(value).lower().replace(",", "").split())
+
+
+async def extraction_accuracy(encoded_pages: list, expected_fields: dict) -> tuple:
+    classification_message = HumanMessage(content=[{"type": "text", "text": main.classification_prompt_template}, {"type": "image_url", "image_url": encoded_pages[0]}])
+    doc_type = (await main.invoke_llm([classification_message])).strip()
+    extraction_prompt = main.extraction_prompts.get(doc_type, main.extraction_prompts["Default"])
+    extraction_model = main.extraction_models.get(doc_type, main.extraction_models["Default"])
+    try:
+        extracted = (await main.extract_structured(extraction_prompt, encoded_pages, extraction_model))["extracted_data"]
+    except HTTPException:
+        extracted = {}
+
+    matches = 0
+    for field, expected_value in expected_fields.items():
+        details = extracted.get(field)
+        value = details.get("value") if isinstance(details, dict) else details
+        if value is not None and normalise(value) == normalise(expected_value):
+            matches += 1
+    return matches, len(expected_fields)
+
+
+async def run(args):
+    documents = {}
+    for filename in sorted(os.listdir(args.documents)):
+        if filename.lower().endswith(('.pdf', '.png', '.jpg', '.jpeg')):
+            with open(os.path.join(args.documents, filename), "rb") as f:
+                documents[filename.lower()] = f.read()
+    if not documents:
+        sys.exit(f"No PDF or image files found in {args.documents}")
+
+    ground_truth = {}
+    if args.ground_truth:
+        with open(args.ground_truth) as f:
+            ground_truth = {name.lower(): fields for name, fields in json.load(f).items()}
+
+    print(f"{'setting':<34} {'pages':>6} {'payload KB':>11} {'KB/page':>8} {'encode ms':>10} {'accuracy':>9}")
+    for setting_name, profile in SETTINGS.items():
+        total_pages, payload_bytes, encode_seconds = 0, 0, 0.0
+        matched_fields, total_fields = 0, 0
+        for filename, file_content in documents.items():
+            started = time.perf_counter()
+            encoded_pages = encode_document(file_content, filename, profile)
+            encode_seconds += time.perf_counter() - started
+            total_pages += len(encoded_pages)
+            payload_bytes += sum(len(page) for page in encoded_pages)
+
+            if args.with_model and filename in ground_truth:
+                matches, fields = await extraction_accuracy(encoded_pages, ground_truth[filename])
+                matched_fields += matches
+                total_fields += fields
+
+        accuracy = f"{matched_fields / total_fields * 100:.1f}%" if total_fields else "n/a"
+        print(f"{setting_name:<34} {total_pages:>6} {payload_bytes / 1024:>11.1f} {payload_bytes / 1024 / max(total_pages, 1):>8.1f} {encode_seconds * 1000:>10.0f} {accuracy:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare image pipeline settings by payload size, encode time and extraction accuracy.")
+    parser.add_argument("--documents", required=True, help="Folder with sample PDFs and images")
+    parser.add_argument("--ground-truth", help="JSON file mapping filenames to expected field values")
+    parser.add_argument("--with-model", action="store_true", help="Call the model to measure extraction accuracy (needs GOOGLE_API_KEY)")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,479 @@
+"""
+Offline load test of POST /process-application/.
+
+Runs the API in-process with an in-process fake in place of the Gemini client (configurable latency and
+error injection) and an in-memory MongoDB stand-in, and replays a synthetic corpus: a payslip scan, a
+PAN card photo and a multi-page bank statement PDF. It reports per-application latency percentiles,
+documents per second, peak RSS and how the time splits across rasterisation, encoding, model wait and
+database calls. Save a run with --json-out and pass it to --compare after a change to see the difference.
+
+Usage:
+    python benchmarks/load_test.py --applications 50 --concurrency 8 --latency 1.5 --error-rate 0.05
+    python benchmarks/load_test.py --applications 50 --json-out before.json
+    python benchmarks/load_test.py --applications 50 --compare before.json
+
+Needs httpx and mongomock-motor (pip install httpx mongomock-motor), and poppler for the PDF statement
+(--statement-pages 0 leaves it out). --gemini-base-url uses the real client against
+benchmarks/fake_gemini_server.py instead of the in-process fake, --mongo-url a real MongoDB server.
+The model call quota still applies, raise LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE (or --rpm)
+to measure the pipeline rather than the quota.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import inspect
+import resource
+import functools
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw, ImageFont
+
+from fake_gemini_server import answer_for
+
+try:
+    import httpx
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError as e:
+    sys.exit(f"The load test needs httpx and mongomock-motor ({e}). Install them with: pip install httpx mongomock-motor")
+
+MIME_TYPES = {".pdf": "application/pdf", ".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+
+# --- Synthetic corpus ---
+
+def font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def add_scan_noise(image: Image.Image, amount: int):
+    pixels = image.load()
+    for _ in range(amount):
+        x, y = random.randrange(image.width), random.randrange(image.height)
+        shade = random.randint(150, 230)
+        pixels[x, y] = (shade, shade, shade)
+
+
+def payslip_page() -> Image.Image:
+    page = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(page)
+    draw.text((80, 80), "ACME INDUSTRIES PVT LTD", fill="black", font=font(44))
+    draw.text((80, 150), "Payslip for the month of March 2024", fill="black", font=font(28))
+    rows = [
+        ("Employee Name", "Ravi Kumar"), ("Employee ID", "AC-10293"), ("Designation", "Senior Analyst"),
+        ("Pay Period End Date", "31/03/2024"), ("Basic Salary", "42,500.00"), ("House Rent Allowance", "21,250.00"),
+        ("Special Allowance", "21,250.00"), ("Gross Income", "85,000.00"), ("Provident Fund", "5,100.00"),
+        ("Professional Tax", "200.00"), ("Income Tax (TDS)", "9,000.00"), ("Total Taxes", "9,200.00"), ("Net Pay", "70,700.00"),
+    ]
+    for index, (label, value) in enumerate(rows):
+        y = 260 + index * 70
+        draw.line((80, y - 12, 1160, y - 12), fill=(190, 190, 190), width=2)
+        draw.text((100, y), label, fill="black", font=font(28))
+        draw.text((760, y), value, fill="black", font=font(28))
+    add_scan_noise(page, 20000)
+    return page
+
+
+def pan_card() -> Image.Image:
+    card = Image.new("RGB", (1011, 638), (214, 232, 245))
+    draw = ImageDraw.Draw(card)
+    draw.text((40, 30), "INCOME TAX DEPARTMENT", fill=(20, 40, 120), font=font(36))
+    draw.text((620, 30), "GOVT. OF INDIA", fill=(20, 40, 120), font=font(36))
+    draw.rectangle((760, 150, 960, 400), fill=(160, 160, 170))
+    fields = [("Name", "RAVI KUMAR"), ("Father's Name", "SURESH KUMAR"), ("Date of Birth", "14/08/1990"), ("Permanent Account Number", "ABCPK1234F")]
+    for index, (label, value) in enumerate(fields):
+        draw.text((40, 130 + index * 110), label, fill=(60, 60, 60), font=font(24))
+        draw.text((40, 165 + index * 110), value, fill="black", font=font(34))
+    add_scan_noise(card, 30000)
+    return card
+
+
+def bank_statement_pages(page_count: int) -> list:
+    pages = []
+    balance = 152340.0
+    for page_number in range(1, page_count + 1):
+        page = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(page)
+        draw.text((80, 60), "STATE BANK OF EXAMPLE - Account Statement", fill="black", font=font(34))
+        draw.text((80, 110), f"Account Holder: Ravi Kumar    Account No: 3011 0456 7789    Page {page_number} of {page_count}", fill="black", font=font(22))
+        for row in range(36):
+            amount = round(random.uniform(-25000, 30000), 2)
+            balance += amount
+            y = 180 + row * 42
+            draw.text((80, y), f"{(row % 28) + 1:02d}/{page_number:02d}/2024", fill="black", font=font(22))
+            draw.text((260, y), random.choice(["UPI/GROCERY", "NEFT/SALARY ACME", "ATM WDL", "EMI HOME LOAN", "IMPS/RENT", "POS FUEL"]), fill="black", font=font(22))
+            draw.text((760, y), f"{amount:,.2f}", fill="black", font=font(22))
+            draw.text((980, y), f"{balance:,.2f}", fill="black", font=font(22))
+        pages.append(page)
+    return pages
+
+
+def build_corpus(directory: str, statement_pages: int) -> list:
+    paths = []
+    payslip_path = os.path.join(directory, "payslip.png")
+    payslip_page().save(payslip_path, "PNG")
+    paths.append(payslip_path)
+    pan_path = os.path.join(directory, "pan_card.jpg")
+    pan_card().save(pan_path, "JPEG", quality=90)
+    paths.append(pan_path)
+    if statement_pages > 0:
+        statement_path = os.path.join(directory, "bank_statement.pdf")
+        pages = bank_statement_pages(statement_pages)
+        pages[0].save(statement_path, "PDF", resolution=150, save_all=True, append_images=pages[1:])
+        paths.append(statement_path)
+    return paths
+
+
+def load_corpus(paths: list) -> list:
+    corpus = []
+    for path in paths:
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path).lower(), f.read(), MIME_TYPES[extension]))
+    return corpus
+
+
+# --- Fake model ---
+
+class FakeModelError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"{code} injected failure from the fake model")
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, content: str, prompt_tokens: int):
+        self.content = content
+        response_tokens = len(content) // 4
+        self.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": response_tokens, "total_tokens": prompt_tokens + response_tokens}
+
+
+class FakeChatModel:
+    """Answers like benchmarks/fake_gemini_server.py, in-process, with the ``ainvoke(messages, **options)`` interface of the Gemini client."""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    async def ainvoke(self, messages: list, **options):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.error_rate:
+            raise FakeModelError(random.choice([429, 503]))
+
+        content = messages[0].content
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        prompt = " ".join(part.get("text", "") for part in parts)
+        image_count = sum(1 for part in parts if part.get("type") == "image_url")
+        schema = options.get("response_json_schema") or {}
+        schema_fields = list(schema.get("properties", {}).get("extracted_data", {}).get("properties", {}))
+        return FakeResponse(answer_for(prompt, schema_fields), len(prompt) // 4 + image_count * 258)
+
+
+# --- Stage timing ---
+
+class StageTimer:
+    """Wall time spent per stage, summed over everything running concurrently."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def add(self, stage: str, seconds: float):
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+
+    def wrap(self, stage: str, func):
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    async def timed_awaitable(self, stage: str, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+
+class TimedCollection:
+    """Wraps a Motor collection and times every awaited call on it."""
+
+    def __init__(self, collection, timer: StageTimer):
+        self._collection = collection
+        self._timer = timer
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self._timer.timed_awaitable("database", result) if inspect.isawaitable(result) else result
+        return call
+
+
+def time_in_worker(func, counter):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with counter.get_lock():
+                counter.value += time.perf_counter() - started
+    return timed
+
+
+def install_worker_timers(raster_seconds, encode_seconds):
+    # Runs once in every rasterisation worker; the pool pickles the worker functions by name, so the
+    # timed versions installed here are the ones that run
+    import main
+    main.encode_page = time_in_worker(main.encode_page, encode_seconds)
+    main.render_pdf_pages = time_in_worker(main.render_pdf_pages, raster_seconds)
+    main.encode_image_file = time_in_worker(main.encode_image_file, raster_seconds)
+
+
+# --- Load run ---
+
+def configure_environment(args):
+    # main.py reads its configuration at import time
+    os.environ["MONGO_DETAILS"] = args.mongo_url or os.environ.get("MONGO_DETAILS") or "mongodb://127.0.0.1:27017"
+    os.environ.setdefault("GOOGLE_API_KEY", "fake")
+    if args.gemini_base_url:
+        os.environ["GEMINI_BASE_URL"] = args.gemini_base_url
+    if args.rpm:
+        os.environ["LLM_REQUESTS_PER_MINUTE"] = str(args.rpm)
+        os.environ["LLM_TOKENS_PER_MINUTE"] = str(args.rpm * 20000)
+
+
+def prepare_app(args, timer: StageTimer):
+    import main
+
+    # Builds the (lazily created) client and collections, so they can be swapped before the app's warm-up runs
+    main.init_database()
+    if not args.gemini_base_url:
+        main.llm_scheduler.model = FakeChatModel(args.latency, args.jitter, args.error_rate)
+    if not args.mongo_url:
+        main.client = AsyncMongoMockClient()
+        mock_db = main.client[main.db.name]
+        main.db = mock_db
+        main.verified_collection = mock_db.get_collection(main.verified_collection.name)
+        main.cache_collection = mock_db.get_collection(main.cache_collection.name)
+        main.applications_collection = mock_db.get_collection(main.applications_collection.name)
+        # mongomock has no sessions, so saves use the bulk-write path of a standalone server
+        main.mongo_transactions_supported = False
+    main.verified_collection = TimedCollection(main.verified_collection, timer)
+    main.cache_collection = TimedCollection(main.cache_collection, timer)
+    main.applications_collection = TimedCollection(main.applications_collection, timer)
+    if main.extraction_cache.collection is not None:
+        main.extraction_cache.collection = main.cache_collection
+
+    main.rasterise_document = timer.wrap("rasterise_wall", main.rasterise_document)
+    main.invoke_llm = timer.wrap("model_wait", main.invoke_llm)
+
+    # Same worker start method as the API's own pool, the counters are created in that context for the workers
+    context = main.raster_pool_context()
+    worker_counters = (context.Value("d", 0.0), context.Value("d", 0.0))
+    main.raster_pool = ProcessPoolExecutor(max_workers=max(1, main.RASTER_WORKERS), mp_context=context, initializer=install_worker_timers, initargs=worker_counters)
+    return main, worker_counters
+
+
+def unique_copy(content: bytes, filename: str, nonce: str) -> bytes:
+    # Trailing bytes after the image / PDF end marker are ignored by the decoders but change the content
+    # hash, so every application misses the extraction cache like a new upload would
+    return content + (f"\n%{nonce}\n" if filename.endswith(".pdf") else nonce).encode()
+
+
+async def submit_application(client, corpus: list, index: int, args) -> dict:
+    files = []
+    for filename, content, mime_type in corpus:
+        payload = content if args.allow_cache_hits else unique_copy(content, filename, f"load-test-{index}-{random.random()}")
+        files.append(("files", (filename, payload, mime_type)))
+
+    started = time.perf_counter()
+    response = await client.post("/process-application/", files=files)
+    latency = time.perf_counter() - started
+    outcome = {"latency": latency, "status": response.status_code, "documents": len(files), "failed_documents": 0, "failed_saves": 0, "errors": []}
+    if response.status_code != 200:
+        outcome["errors"].append(response.text[:300])
+        return outcome
+
+    results = response.json()["individual_document_results"]
+    for result in results:
+        if "error" in result:
+            outcome["failed_documents"] += 1
+            outcome["errors"].append(f"{result.get('filename')}: {result['error']}"[:300])
+    if args.save:
+        documents = [
+            {"filename": res["filename"], "original_ai_data": res, "verified_data": {field: str((details or {}).get("value") or "") if isinstance(details, dict) else str(details) for field, details in res.get("extracted_data", {}).items()}}
+            for res in results if "error" not in res
+        ]
+        if documents:
+            save_response = await client.post("/save-verified-application/", json={"application_id": response.json()["application_id"], "documents": documents})
+            if save_response.status_code != 200:
+                outcome["failed_saves"] += 1
+                outcome["errors"].append(f"save {save_response.status_code}: {save_response.text}"[:300])
+    return outcome
+
+
+def percentile(values: list, share: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(share * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+async def run(args, corpus: list) -> dict:
+    timer = StageTimer()
+    main, (raster_seconds, encode_seconds) = prepare_app(args, timer)
+
+    outcomes = []
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load-test", timeout=None) as client:
+            for index in range(args.warmup):
+                await submit_application(client, corpus, -1 - index, args)
+            timer.seconds.clear()
+            timer.calls.clear()
+            raster_seconds.value = encode_seconds.value = 0.0
+            calls_before, retries_before = main.llm_scheduler.calls, main.llm_scheduler.retries
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def bounded(index: int):
+                async with semaphore:
+                    outcomes.append(await submit_application(client, corpus, index, args))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(bounded(index) for index in range(args.applications)))
+            wall_seconds = time.perf_counter() - started
+            model_calls = main.llm_scheduler.calls - calls_before
+            model_retries = main.llm_scheduler.retries - retries_before
+    # Leaving the lifespan shut the rasterisation pool down, so its workers now count as reaped children
+
+    latencies = [outcome["latency"] for outcome in outcomes]
+    documents = sum(outcome["documents"] for outcome in outcomes)
+    stages = {
+        "rasterisation": raster_seconds.value - encode_seconds.value,
+        "encoding": encode_seconds.value,
+        "rasterise_wall": timer.seconds["rasterise_wall"],
+        "model_wait": timer.seconds["model_wait"],
+        "database": timer.seconds["database"],
+    }
+    return {
+        "applications": len(outcomes),
+        "concurrency": args.concurrency,
+        "documents": documents,
+        "failed_requests": sum(1 for outcome in outcomes if outcome["status"] != 200),
+        "failed_documents": sum(outcome["failed_documents"] for outcome in outcomes),
+        "failed_saves": sum(outcome["failed_saves"] for outcome in outcomes),
+        "first_errors": [error for outcome in outcomes for error in outcome["errors"]][:3],
+        "wall_seconds": round(wall_seconds, 3),
+        "latency_p50": round(percentile(latencies, 0.50), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "latency_p99": round(percentile(latencies, 0.99), 3),
+        "latency_max": round(max(latencies, default=0.0), 3),
+        "documents_per_second": round(documents / wall_seconds, 3) if wall_seconds else 0.0,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_worker_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "model_calls": model_calls,
+        "model_retries": model_retries,
+        "database_calls": timer.calls["database"],
+        "stage_seconds": {stage: round(seconds, 3) for stage, seconds in stages.items()},
+    }
+
+
+def print_report(report: dict):
+    print(f"Applications      {report['applications']} ({report['concurrency']} concurrent), {report['documents']} documents")
+    print(f"Failures          {report['failed_requests']} requests, {report['failed_documents']} documents, {report.get('failed_saves', 0)} saves")
+    for error in report["first_errors"]:
+        print(f"                  {error}")
+    print(f"Latency           p50 {report['latency_p50']:.2f}s  p95 {report['latency_p95']:.2f}s  p99 {report['latency_p99']:.2f}s  max {report['latency_max']:.2f}s")
+    print(f"Throughput        {report['documents_per_second']:.2f} documents/s over {report['wall_seconds']:.1f}s")
+    print(f"Peak RSS          {report['peak_rss_mb']:.0f} MB API process, {report['peak_worker_rss_mb']:.0f} MB largest rasterisation worker")
+    print(f"Model calls       {report['model_calls']} ({report['model_retries']} retries), {report['database_calls']} database calls")
+    print("Time split        (seconds summed over concurrent work; rasterisation and encoding run in the worker pool)")
+    split = {stage: report["stage_seconds"][stage] for stage in ("rasterisation", "encoding", "model_wait", "database")}
+    total = sum(split.values()) or 1.0
+    for stage, seconds in split.items():
+        print(f"  {stage:<16}{seconds:>10.2f}s {seconds / total * 100:>6.1f}%")
+    print(f"  {'rasterise wall':<16}{report['stage_seconds']['rasterise_wall']:>10.2f}s  (callers waiting on the pool, incl. queueing and speculative renders)")
+
+
+def print_comparison(report: dict, baseline: dict):
+    print(f"\n{'metric':<26}{'baseline':>12}{'current':>12}{'change':>10}")
+    metrics = {key: value for key, value in report.items() if isinstance(value, (int, float))}
+    metrics.update({f"stage.{stage}": seconds for stage, seconds in report["stage_seconds"].items()})
+    baseline_metrics = {key: value for key, value in baseline.items() if isinstance(value, (int, float))}
+    baseline_metrics.update({f"stage.{stage}": seconds for stage, seconds in baseline.get("stage_seconds", {}).items()})
+    for key, value in metrics.items():
+        if key not in baseline_metrics:
+            continue
+        before = baseline_metrics[key]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{key:<26}{before:>12}{value:>12}{change:>10}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test /process-application/ offline with a fake model and an in-memory MongoDB.")
+    parser.add_argument("--applications", type=int, default=20, help="Applications to submit (after the warm-up)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Applications in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="Applications submitted first and left out of the results")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds each fake model call takes")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Random +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake model calls failing with 429/503")
+    parser.add_argument("--statement-pages", type=int, default=8, help="Pages in the synthetic bank statement PDF (0 leaves it out)")
+    parser.add_argument("--corpus", help="Folder of PDFs/images to replay instead of the synthetic corpus")
+    parser.add_argument("--keep-corpus", help="Write the synthetic corpus to this folder and keep it")
+    parser.add_argument("--allow-cache-hits", action="store_true", help="Replay identical files, so repeats hit the extraction cache")
+    parser.add_argument("--save", action="store_true", help="Also save every application through /save-verified-application/")
+    parser.add_argument("--rpm", type=int, help="Model requests per minute allowed by the scheduler (default: LLM_REQUESTS_PER_MINUTE)")
+    parser.add_argument("--gemini-base-url", help="Use the real Gemini client against this endpoint, e.g. the fake model server")
+    parser.add_argument("--mongo-url", help="Use this MongoDB server instead of the in-memory stand-in")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json-out", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    configure_environment(args)
+    if args.corpus:
+        paths = [os.path.join(args.corpus, name) for name in sorted(os.listdir(args.corpus)) if os.path.splitext(name)[1].lower() in MIME_TYPES]
+        if not paths:
+            sys.exit(f"No PDF or image files found in {args.corpus}")
+        corpus = load_corpus(paths)
+    else:
+        corpus_dir = args.keep_corpus or tempfile.mkdtemp(prefix="load-test-corpus-")
+        os.makedirs(corpus_dir, exist_ok=True)
+        corpus = load_corpus(build_corpus(corpus_dir, args.statement_pages))
+
+    report = asyncio.run(run(args, corpus))
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
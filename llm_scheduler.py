@@ -0,0 +1,252 @@
+"""
+Shared scheduler for every model call made by the API.
+
+All calls go through one LLMScheduler, which
+  * keeps requests per minute and tokens per minute under the quota with two token buckets,
+  * retries transient failures (429, 5xx, timeouts, dropped connections) with exponential backoff and full jitter,
+    all within one overall deadline per call,
+  * opens a circuit breaker after repeated transient failures so a struggling model is not hammered,
+  * keeps counters (queue depth, wait time, retries) that the API exposes.
+
+It only needs an object with an async ``ainvoke(messages, **options)`` method, so it can be pointed at the real
+Gemini client, a client configured with a local fake model server, or an in-process fake. With ``model_factory``
+the model is only built on the first call (or by ``get_model``), which keeps a slow SDK import out of start-up.
+``clock`` and ``sleep`` can be swapped for fakes in tests.
+"""
+import time
+import random
+import asyncio
+from typing import Callable, Optional
+
+# Gemini bills a page image as a fixed number of tokens, text is roughly four characters per token
+IMAGE_TOKEN_ESTIMATE = 258
+CHARS_PER_TOKEN = 4
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_MARKERS = ("429", "resource_exhausted", "resource exhausted", "rate limit", "quota", "unavailable", "deadline", "overloaded", "try again")
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and calls are rejected without reaching the model."""
+
+
+class TokenBucket:
+    """Refills ``rate_per_minute`` units per minute up to that same capacity."""
+
+    def __init__(self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic, sleep: Callable = asyncio.sleep):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.fill_rate = rate_per_minute / 60.0
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.fill_rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0):
+        # The lock makes waiters queue up in arrival order instead of racing for refills
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await self.sleep((amount - self.tokens) / self.fill_rate)
+
+    def adjust(self, amount: float):
+        # Settles the difference between the estimate taken up front and the real usage,
+        # the balance may go negative so later callers pay for an underestimate
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive transient failures and lets one probe through after ``reset_seconds``."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        if self.state == "open":
+            if self.clock() - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError("The AI model is failing repeatedly, calls are paused for a moment.")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                raise CircuitOpenError("The AI model is recovering, only one probe call is allowed at a time.")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = self.clock()
+
+    def release(self):
+        # A call that ended without a verdict (e.g. a non-transient error) frees the probe slot
+        self._probe_in_flight = False
+
+
+def is_transient_error(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    for attribute in ("code", "status_code"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int):
+            return code in TRANSIENT_STATUS_CODES
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+
+def estimate_tokens(messages: list, expected_response_tokens: int) -> int:
+    tokens = expected_response_tokens
+    for message in messages:
+        content = message.content
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKEN_ESTIMATE
+            else:
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+    return tokens
+
+
+class LLMScheduler:
+    def __init__(self, model, requests_per_minute: int, tokens_per_minute: int, max_retries: int = 3,
+                 base_delay: float = 1.0, max_delay: float = 30.0, failure_threshold: int = 5,
+                 reset_seconds: float = 30.0, expected_response_tokens: int = 512, model_factory: Optional[Callable] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable = asyncio.sleep):
+        self.model = model
+        self.model_factory = model_factory
+        self.clock = clock
+        self.sleep = sleep
+        self.request_bucket = TokenBucket(requests_per_minute, clock, sleep)
+        self.token_bucket = TokenBucket(tokens_per_minute, clock, sleep)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds, clock)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_response_tokens = expected_response_tokens
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.last_wait_seconds = 0.0
+
+    def get_model(self):
+        if self.model is None:
+            self.model = self.model_factory()
+        return self.model
+
+    async def _wait_for_quota(self, estimated_tokens: int):
+        self.queue_depth += 1
+        started = self.clock()
+        try:
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(estimated_tokens)
+        finally:
+            self.queue_depth -= 1
+            waited = self.clock() - started
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.last_wait_seconds = waited
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: anywhere between zero and the exponential cap, so retries from a burst spread out
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - self.clock())
+
+    async def invoke(self, messages: list, timeout: Optional[float] = None, **options):
+        # ``options`` are passed through to the model call, e.g. the response schema for JSON mode.
+        # ``timeout`` is one deadline for the whole call: quota waits, every attempt and the backoff between them
+        estimated_tokens = estimate_tokens(messages, self.expected_response_tokens)
+        deadline = None if timeout is None else self.clock() + timeout
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.rejected += 1
+                raise
+            try:
+                await self._wait_for_quota(estimated_tokens)
+            except BaseException:
+                self.breaker.release()
+                raise
+            remaining = self._remaining(deadline)
+            if remaining == 0:
+                # The deadline ran out while queueing for quota, which says nothing about the model's health
+                self.breaker.release()
+                self.failures += 1
+                raise asyncio.TimeoutError("The model call ran out of time waiting for rate limit quota.")
+            try:
+                self.calls += 1
+                self.in_flight += 1
+                try:
+                    response = await asyncio.wait_for(self.get_model().ainvoke(messages, **options), timeout=remaining)
+                finally:
+                    self.in_flight -= 1
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not is_transient_error(e):
+                    self.breaker.release()
+                    self.failures += 1
+                    raise
+                self.breaker.record_failure()
+                delay = self._backoff(attempt + 1)
+                remaining = self._remaining(deadline)
+                if attempt >= self.max_retries or self.breaker.state == "open" or (remaining is not None and delay >= remaining):
+                    self.failures += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                await self.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            usage = getattr(response, "usage_metadata", None) or {}
+            if usage.get("total_tokens"):
+                self.token_bucket.adjust(usage["total_tokens"] - estimated_tokens)
+            return response
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected_by_circuit_breaker": self.rejected,
+            "circuit_state": self.breaker.state,
+            "average_wait_seconds": round(self.total_wait_seconds / self.calls, 3) if self.calls else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+            "last_wait_seconds": round(self.last_wait_seconds, 3),
+            "requests_available": round(self.request_bucket.tokens, 1),
+            "tokens_available": round(self.token_bucket.tokens, 1)
+        }
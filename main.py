@@ -4,36 +4,216 @@ import json
 import base64
 import re
 import uuid
+import time
+import copy
+import hashlib
+import zlib
+import logging
+import asyncio
+import tempfile
+import threading
+import contextvars
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from pydantic import BaseModel
-from typing import Dict, Any, List
-from PIL import Image
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
+from typing import Dict, Any, List, Optional, Callable
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from dotenv import load_dotenv
-from pdf2image import convert_from_bytes
-# --- NEW: MongoDB Dependencies ---
-import motor.motor_asyncio
-from bson import ObjectId
+# --- NEW: Heavy dependencies (the Gemini SDK and langchain, motor/pymongo, PIL, pdf2image, pypdf) are imported
+# where they are first used, so the server binds its port quickly after a cold start. See warm_up() below.
+from llm_scheduler import LLMScheduler, CircuitOpenError, CHARS_PER_TOKEN
+from validation_rules import validate_application
+from metrics import Counter, Gauge, Histogram, ApplicationTrace, current_trace, record_span, stage_span, render_metrics
+from structured_output import (
+    CrossValidationReport, FinalSummaryReport, StructuredOutputError, build_extraction_model, field_repair_model,
+    loads_tolerant, parse_model_answer, prompt_field_names, response_json_schema, validate_extraction
+)
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 app = FastAPI(title="Intelligent Document Processor API")
 
-# --- NEW: MongoDB Connection ---
+# --- NEW: MongoDB Connection (created by init_database() on start-up or first use) ---
 MONGO_DETAILS = os.getenv("MONGO_DETAILS")
-if not MONGO_DETAILS:
-    raise ValueError("MONGO_DETAILS environment variable not set!")
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+client = None
+db = None
+verified_collection = None
+cache_collection = None
+applications_collection = None
+database_lock = threading.Lock()
 
-db = client.loan_processing
-verified_collection = db.get_collection("verified_documents")
+def init_database():
+    # Building the client resolves mongodb+srv hosts, so it is kept out of import (and may run in a thread).
+    # Tests and benchmarks can set the globals first, they are then left alone.
+    global client, db, verified_collection, cache_collection, applications_collection
+    with database_lock:
+        if client is not None:
+            return
+        if not MONGO_DETAILS:
+            raise HTTPException(status_code=503, detail="MONGO_DETAILS environment variable not set!")
+        import motor.motor_asyncio
+        client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+        db = client.loan_processing
+        verified_collection = db.get_collection("verified_documents")
+        cache_collection = db.get_collection("extraction_cache")
+        applications_collection = db.get_collection("applications")
+        if EXTRACTION_CACHE_PERSIST and extraction_cache.collection is None:
+            extraction_cache.collection = cache_collection
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0)
+async def ensure_database():
+    # What endpoints call: init_database() takes a lock and may resolve DNS, so it runs in a thread and the event
+    # loop keeps serving. Usually the start-up warm-up has already created the client and this returns at once
+    if client is None:
+        await asyncio.to_thread(init_database)
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")
+# GEMINI_BASE_URL points the client at another endpoint, e.g. a local fake model server for load tests.
+# Retries are left to the scheduler below so a burst of 429s is not retried twice.
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+def create_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=GEMINI_MODEL, temperature=0, max_retries=0, **({"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else {}))
+
+def human_message(content):
+    from langchain_core.messages import HumanMessage
+    return HumanMessage(content=content)
+
+# --- NEW: Shared model call scheduler (rate limits, retries with jitter, circuit breaker) ---
+llm_scheduler = LLMScheduler(
+    None,
+    requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+    base_delay=float(os.getenv("LLM_RETRY_BASE_SECONDS", "1")),
+    max_delay=float(os.getenv("LLM_RETRY_MAX_SECONDS", "30")),
+    failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+    reset_seconds=float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30")),
+    model_factory=create_llm
+)
+
+# --- NEW: Metrics exposed on /metrics (stage durations are recorded through metrics.stage_span) ---
+APPLICATION_SECONDS = Histogram("loan_application_duration_seconds", "End-to-end processing time of an application in seconds.")
+DOCUMENTS_PROCESSED = Counter("loan_documents_processed_total", "Documents processed, by outcome.", ("outcome",))
+EXTRACTION_CACHE_REQUESTS = Counter("loan_extraction_cache_requests_total", "Extraction cache lookups, by result.", ("result",))
+PAGES_SENT = Counter("loan_pages_sent_total", "Document pages sent to the model for extraction, as text (PDF text layer) or as images.", ("form",))
+MODEL_OUTPUT_FAILURES = Counter("loan_model_output_failures_total", "Model answers that could not be parsed or failed schema validation.", ("stage", "kind"))
+Counter("loan_model_calls_total", "Model calls sent, including retries.", collect=lambda: llm_scheduler.calls)
+Counter("loan_model_retries_total", "Model calls retried after a transient failure.", collect=lambda: llm_scheduler.retries)
+Counter("loan_model_failures_total", "Model calls that failed after all retries.", collect=lambda: llm_scheduler.failures)
+Counter("loan_model_rejected_total", "Model calls rejected by the open circuit breaker.", collect=lambda: llm_scheduler.rejected)
+Gauge("loan_model_queue_depth", "Model calls waiting for rate limit quota.", collect=lambda: llm_scheduler.queue_depth)
+Gauge("loan_model_in_flight", "Model calls in flight.", collect=lambda: llm_scheduler.in_flight)
+
+# --- NEW: Upper bound on how many files of one application are processed at the same time ---
+MAX_CONCURRENT_FILES = int(os.getenv("MAX_CONCURRENT_FILES", "4"))
+
+# --- NEW: Background job queue for /applications/ (in-process, no external broker) ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+# --- NEW: Prompt token budgets for the application-level stages (estimated at ~4 characters per token) ---
+CROSS_VALIDATION_TOKEN_BUDGET = int(os.getenv("CROSS_VALIDATION_TOKEN_BUDGET", "4000"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "8000"))
+ANALYSIS_CHAR_LIMIT = int(os.getenv("ANALYSIS_CHAR_LIMIT", "600"))
+
+# --- NEW: Cross-validation mode ---
+# "rules" settles names, dates of birth and ID numbers with deterministic checks and only asks the model
+# about comparisons the rules cannot decide, "model" sends every document to the model as before
+CROSS_VALIDATION_MODE = os.getenv("CROSS_VALIDATION_MODE", "rules").lower()
+
+# Token usage of every model call made for the current application, and the document being processed
+token_usage_log = contextvars.ContextVar("token_usage_log", default=None)
+current_document = contextvars.ContextVar("current_document", default=None)
+
+# --- NEW: Reporting ---
+REPORT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("REPORT_HISTORY_MAX_PAGE_SIZE", "500"))
+
+# --- NEW: Ask the model for JSON that follows each prompt's response schema (turn off for endpoints without JSON mode) ---
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "true").lower() == "true"
+
+# --- NEW: Overall deadline of one model call (retries included) and how often we check whether the client is still connected ---
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1"))
+
+# --- NEW: Worker processes for PDF rasterisation and image encoding (CPU-bound, kept off the event loop) ---
+# Each worker holds about 100 MB once it has rendered a page, and os.cpu_count() is the host's count inside a
+# container, so the default is a fixed 2 (fewer when the process may only use one CPU) that fits a 512 MB instance
+USABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", str(min(2, USABLE_CPUS))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+raster_pool = None
+
+# --- NEW: Upload limits (uploads are spooled to temp files instead of being held in memory) ---
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "100"))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+# --- NEW: Extraction cache keyed by document hash (in-memory LRU + optional MongoDB tier) ---
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "512"))
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+EXTRACTION_CACHE_PERSIST = os.getenv("EXTRACTION_CACHE_PERSIST", "true").lower() == "true"
+
+# --- NEW: Image pipeline profiles (render DPI, max side in pixels, colour and compression of the pages sent to the model) ---
+# Override any profile with a JSON object in IMAGE_PROFILES, e.g. {"Default": {"format": "WEBP", "quality": 70}}
+# Use benchmarks/image_settings.py to compare settings on real documents before changing them.
+IMAGE_PROFILES = {
+    # Cheap first-page render, only used to classify the document
+    "Thumbnail": {"dpi": 72, "max_side": 768, "grayscale": False, "format": "JPEG", "quality": 70},
+    "Default": {"dpi": 150, "max_side": 1600, "grayscale": True, "format": "JPEG", "quality": 80},
+    # ID cards carry photos, holograms and small print, so they keep colour
+    "Identity": {"dpi": 200, "max_side": 1280, "grayscale": False, "format": "JPEG", "quality": 85},
+    # Dense tables need a little more resolution but compress well in grayscale
+    "Statement": {"dpi": 150, "max_side": 2000, "grayscale": True, "format": "JPEG", "quality": 75},
+}
+for profile_name, overrides in json.loads(os.getenv("IMAGE_PROFILES", "{}")).items():
+    IMAGE_PROFILES[profile_name] = {**IMAGE_PROFILES.get(profile_name, IMAGE_PROFILES["Default"]), **overrides}
+
+# --- NEW: Classification shortcuts ---
+# Render the remaining pages while the classification call is in flight, with the Statement profile for
+# multi-page scans and the Default profile otherwise (see speculative_profile_for())
+SPECULATIVE_RENDER = os.getenv("SPECULATIVE_RENDER", "true").lower() == "true"
+# Classify and extract in a single model call (halves round trips, pages always use the Default profile)
+SINGLE_CALL_EXTRACTION = os.getenv("SINGLE_CALL_EXTRACTION", "false").lower() == "true"
+
+# --- NEW: Text layer fast path for born-digital PDFs ---
+# PDF pages whose text layer has at least TEXT_LAYER_MIN_CHARS characters and TEXT_LAYER_MIN_DENSITY non-blank
+# characters per square inch of page are sent to the model as text instead of being rasterised. Scanned pages
+# (no text, or only a typed header or footer over the scan) go through the image pipeline.
+TEXT_LAYER_EXTRACTION = os.getenv("TEXT_LAYER_EXTRACTION", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "100"))
+TEXT_LAYER_MIN_DENSITY = float(os.getenv("TEXT_LAYER_MIN_DENSITY", "5"))
+# Only this much of the first page is sent to classify a document from its text
+TEXT_LAYER_CLASSIFICATION_CHARS = int(os.getenv("TEXT_LAYER_CLASSIFICATION_CHARS", "3000"))
+
+# --- NEW: Chunked extraction for long documents ---
+# Documents with more pages than the threshold for their type are extracted in windows of
+# EXTRACTION_CHUNK_PAGES pages, concurrently, and the partial results are merged.
+# Override with a JSON object in CHUNKED_EXTRACTION_THRESHOLDS, e.g. {"Bank Statement": 4}
+CHUNKED_EXTRACTION_THRESHOLDS = {"Bank Statement": 6, "Default": 10}
+CHUNKED_EXTRACTION_THRESHOLDS.update(json.loads(os.getenv("CHUNKED_EXTRACTION_THRESHOLDS", "{}")))
+EXTRACTION_CHUNK_PAGES = int(os.getenv("EXTRACTION_CHUNK_PAGES", "5"))
+
+DOCUMENT_IMAGE_PROFILES = {
+    "PAN Card": "Identity",
+    "Aadhaar Card": "Identity",
+    "Driving License": "Identity",
+    "Bank Statement": "Statement",
+}
 
 # --- PROMPT ENGINEERING UPGRADE ---
 
+# Bump this whenever the format of the extraction results changes (prompt text and settings are hashed into
+# the cache key by extraction_fingerprint(), so they need no bump)
+PROMPT_VERSION = "2"
+
 # 1. More specific classification options
 classification_prompt_template = """
 You are an expert document classifier. Your task is to analyze the provided document image and identify its type.
@@ -75,6 +255,45 @@ extraction_prompts = {
     """
 }
 
+# 1b. Documents with a text layer are classified and extracted from their text
+text_classification_prompt = """
+You are an expert document classifier. Your task is to identify the type of a document from the text of its first page, given below.
+Respond with only one of the following categories: 'Payslip', 'Tax Form', 'PAN Card', 'Aadhaar Card', 'Driving License', 'Bank Statement', 'Form 16', 'ITR', or 'Other'.
+Do not add any other text or explanation.
+---
+{page_text}
+---
+"""
+text_layer_note = """
+    Some or all pages of the document are given as the text layer of a digital PDF instead of an image, in page order. Read them exactly like the page images.
+    """
+
+# 2b. Classification and extraction in one call, built from the per-type prompts above
+combined_extraction_prompt = """
+You are an expert AI assistant. First identify the type of the provided document as one of: 'Payslip', 'Tax Form', 'PAN Card', 'Aadhaar Card', 'Driving License', 'Bank Statement', 'Form 16', 'ITR', or 'Other'.
+Then extract the fields listed for that type below. For any other type, extract any personally identifiable information (PII) and key financial figures you can find.
+{field_instructions}
+For each field, provide the 'value' and a 'confidence' score.
+Provide your response as a single, valid JSON object with keys "document_type", "extracted_data" and "analysis".
+"""
+extraction_field_lists = {doc_type: re.search(r'extract: (.*?)\n', prompt).group(1) for doc_type, prompt in extraction_prompts.items() if doc_type != "Default"}
+combined_extraction_prompt = combined_extraction_prompt.format(field_instructions="\n".join(f"- {doc_type}: extract {fields}" for doc_type, fields in extraction_field_lists.items()))
+
+# 2c. Answer schemas of the extraction prompts, sent to the model in JSON mode and used to validate its answers
+extraction_models = {doc_type: build_extraction_model(doc_type.replace(" ", ""), prompt_field_names(fields)) for doc_type, fields in extraction_field_lists.items()}
+extraction_models["Default"] = build_extraction_model("Default")
+combined_extraction_model = build_extraction_model("Combined", with_document_type=True)
+
+# 2d. One repair call for an answer that failed validation
+field_repair_prompt = """
+    You are an expert AI assistant. Your previous answer for the provided document image had missing or invalid entries for: {fields}.
+    Extract only these fields. For each field, provide the 'value' (text, a number, or null if it is not on the document) and a 'confidence' score between 0 and 1.
+    Provide your response as a single, valid JSON object with the key "extracted_data".
+    """
+invalid_json_repair_prompt = """
+    Your previous answer to this request could not be read as JSON. Answer again with only the JSON object, without markdown or any other text.
+    """
+
 cross_validation_prompt = """
 You are a senior loan underwriter AI. You have been provided with extracted data from multiple documents for a single loan application.
 Your task is to perform a final cross-validation check. Analyze all the data and identify any critical inconsistencies between the documents.
@@ -87,6 +306,18 @@ Provide a summary of your findings as a single, valid JSON object with two keys:
 The final output must be ONLY the JSON object, with no extra text or markdown.
 """
 
+undecided_cross_validation_prompt = """
+You are a senior loan underwriter AI. Automated checks compared the identity details found in the documents of a single loan application
+and could not decide whether the following values refer to the same person or the same date.
+Consider transliteration variants, initials, missing middle names, name order and date formats.
+Here are the undecided comparisons:
+---
+{undecided_checks}
+---
+Provide your verdict as a single, valid JSON object with two keys: "overall_summary" (a string) and "validation_passed" (a boolean, true only if every comparison refers to the same person or date).
+The final output must be ONLY the JSON object, with no extra text or markdown.
+"""
+
 # 3. A more robust and clearer final summary prompt
 final_summary_prompt = """
 You are the lead AI underwriter. You have been given the complete data extracted from a loan application package.
@@ -108,126 +339,1420 @@ The final output must be ONLY the JSON object.
 """
 
 
-def pil_to_base64(image):
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+def image_profile_for(doc_type: str) -> dict:
+    return IMAGE_PROFILES[DOCUMENT_IMAGE_PROFILES.get(doc_type, "Default")]
+
+def encode_page(image, profile: dict) -> str:
+    # Downscale, optionally drop colour, and compress a page into a data URL for the model
+    from PIL import Image
+    max_side = profile.get("max_side")
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if profile.get("grayscale"):
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    image_format = profile.get("format", "JPEG").upper()
+    save_options = {} if image_format == "PNG" else {"quality": profile.get("quality", 80)}
+    if image_format == "JPEG":
+        save_options["optimize"] = True
     buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
+    image.save(buffered, format=image_format, **save_options)
     img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    return f"data:image/png;base64,{img_str}"
+    return f"data:{IMAGE_MIME_TYPES[image_format]};base64,{img_str}"
+
+def raster_pool_context():
+    # Workers are not forked from the API process: a child forked while another thread holds a lock (e.g. the
+    # warm-up thread half-way through importing a document library) inherits it held and deadlocks. They come
+    # from a single-threaded fork server that has already imported this module and the document libraries,
+    # or from a fresh interpreter where there is no fork server (Windows)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__, "PIL.Image", "pdf2image", "pypdf"])
+        return context
+    return multiprocessing.get_context("spawn")
 
-async def process_single_file(file_content: bytes, filename: str) -> dict:
-    images_to_process = []
+def get_raster_pool() -> ProcessPoolExecutor:
+    # Created on first use so importing this module does not start worker processes
+    global raster_pool
+    if raster_pool is None:
+        raster_pool = ProcessPoolExecutor(max_workers=max(1, RASTER_WORKERS), mp_context=raster_pool_context())
+    return raster_pool
+
+@app.on_event("shutdown")
+def shutdown_raster_pool():
+    global raster_pool
+    if raster_pool is not None:
+        raster_pool.shutdown(cancel_futures=True)
+        raster_pool = None
+
+def render_pdf_pages(file_path: str, first_page: int, last_page: int, profile: dict) -> tuple:
+    # Runs in a worker process. Pages are rendered one at a time and each raw bitmap is freed
+    # before the next one is rendered, only the encoded pages (and how long each step took) travel back.
+    from pdf2image import convert_from_path
+    encoded_pages = []
+    timings = {"render": 0.0, "encode": 0.0}
+    for page_number in range(first_page, last_page + 1):
+        started = time.perf_counter()
+        page = convert_from_path(file_path, dpi=profile["dpi"], first_page=page_number, last_page=page_number)[0]
+        rendered = time.perf_counter()
+        encoded_pages.append(encode_page(page, profile))
+        timings["render"] += rendered - started
+        timings["encode"] += time.perf_counter() - rendered
+        page.close()
+        del page
+    return encoded_pages, timings
+
+def reencode_pages(pages: List[str], profile: dict) -> tuple:
+    # Runs in a worker process. Re-encodes already rendered pages with a smaller profile of the same DPI and
+    # colour, which costs a JPEG decode per page instead of rendering the page again; text pages are kept
+    from PIL import Image
+    started = time.perf_counter()
+    encoded_pages = []
+    for page in pages:
+        if page.startswith("data:"):
+            with Image.open(io.BytesIO(base64.b64decode(page.split(",", 1)[1]))) as image:
+                image.load()
+                page = encode_page(image, profile)
+        encoded_pages.append(page)
+    return encoded_pages, {"encode": time.perf_counter() - started}
+
+def can_reencode(rendered_profile: dict, profile: dict) -> bool:
+    # Downscaling keeps the quality of a page rendered at the same DPI, upscaling or adding colour back does not
+    return (
+        rendered_profile["dpi"] == profile["dpi"]
+        and not (rendered_profile.get("grayscale") and not profile.get("grayscale"))
+        and (rendered_profile.get("max_side") or 0) >= (profile.get("max_side") or float("inf"))
+    )
+
+def encode_image_file(file_path: str, profile: dict) -> tuple:
+    from PIL import Image
+    started = time.perf_counter()
+    with Image.open(file_path) as image:
+        encoded_pages = [encode_page(image, profile)]
+    return encoded_pages, {"encode": time.perf_counter() - started}
+
+async def count_pdf_pages(file_path: str) -> int:
+    from pdf2image import pdfinfo_from_path
+    page_count = (await asyncio.to_thread(pdfinfo_from_path, file_path))["Pages"]
+    if page_count > MAX_PDF_PAGES:
+        raise HTTPException(status_code=413, detail=f"PDF has {page_count} pages, the limit is {MAX_PDF_PAGES}.")
+    return page_count
+
+def record_worker_timings(started: float, timings: dict):
+    # Render and encode run in the worker pool, their spans are the time measured there
+    for stage, seconds in timings.items():
+        record_span(stage, started, seconds, current_document.get())
+
+async def rasterise_document(file_path: str, filename: str, profile: dict, first_page: int = 1, last_page: Optional[int] = None) -> List[str]:
+    loop = asyncio.get_running_loop()
+    pool = get_raster_pool()
+    started = time.perf_counter()
     if filename.endswith('.pdf'):
-        images_to_process = convert_from_bytes(file_content)
+        page_count = await count_pdf_pages(file_path)
+        last_page = min(last_page or page_count, page_count)
+        # Page windows are rendered in parallel across the pool, gather() keeps them in page order
+        page_ranges = [(first, min(first + PDF_PAGES_PER_TASK - 1, last_page)) for first in range(first_page, last_page + 1, max(1, PDF_PAGES_PER_TASK))]
+        windows = await asyncio.gather(*(loop.run_in_executor(pool, render_pdf_pages, file_path, first, last, profile) for first, last in page_ranges))
+        for _, timings in windows:
+            record_worker_timings(started, timings)
+        return [page for pages, _ in windows for page in pages]
     elif filename.endswith(('.png', '.jpg', '.jpeg')):
-        images_to_process.append(Image.open(io.BytesIO(file_content)))
+        if first_page > 1:
+            return []
+        pages, timings = await loop.run_in_executor(pool, encode_image_file, file_path, profile)
+        record_worker_timings(started, timings)
+        return pages
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {filename}")
 
-    if not images_to_process:
-         raise HTTPException(status_code=400, detail="Could not convert document to image.")
+def normalise_page_text(text: str) -> str:
+    # Layout mode pads table columns with spaces, shorter runs keep the columns apart in fewer characters
+    lines = [re.sub(r" {3,}", "  ", line).rstrip() for line in (text or "").splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def read_pdf_text_layer(file_path: str, max_pages: int) -> tuple:
+    # Runs in a worker process. Returns the page count and, within the page limit, the text and the area in
+    # square inches of every page
+    from pypdf import PdfReader
+    started = time.perf_counter()
+    reader = PdfReader(file_path)
+    page_count = len(reader.pages)
+    page_texts = []
+    page_areas = []
+    if page_count <= max_pages:
+        for page in reader.pages:
+            try:
+                page_texts.append(normalise_page_text(page.extract_text(extraction_mode="layout")))
+            except Exception:
+                page_texts.append("")
+            page_areas.append(float(page.mediabox.width) * float(page.mediabox.height) / (72 * 72))
+    return page_count, page_texts, page_areas, {"text_layer": time.perf_counter() - started}
+
+def has_usable_text_layer(text: str, area: float) -> bool:
+    # A scan with a typed header or footer has a few lines of text over a page-sized image, the density tells it
+    # apart from a digital page; small pages (e.g. a digital ID card) need fewer characters for the same density
+    characters = len(re.sub(r"\s", "", text))
+    return len(text) >= TEXT_LAYER_MIN_CHARS and (area <= 0 or characters / area >= TEXT_LAYER_MIN_DENSITY)
+
+async def read_text_layer(file_path: str, filename: str) -> Optional[List[Optional[str]]]:
+    """The text of each page of a PDF, None for a scanned page; None for the whole document when no page has a text layer."""
+    if not TEXT_LAYER_EXTRACTION or not filename.endswith('.pdf'):
+        return None
+    started = time.perf_counter()
+    try:
+        page_count, page_texts, page_areas, timings = await asyncio.get_running_loop().run_in_executor(get_raster_pool(), read_pdf_text_layer, file_path, MAX_PDF_PAGES)
+    except Exception as e:
+        # Encrypted or damaged files are left to the image pipeline
+        logger.warning("Could not read the text layer of %s: %s", filename, e)
+        return None
+    record_worker_timings(started, timings)
+    if page_count > MAX_PDF_PAGES:
+        raise HTTPException(status_code=413, detail=f"PDF has {page_count} pages, the limit is {MAX_PDF_PAGES}.")
+    text_pages = [text if has_usable_text_layer(text, area) else None for text, area in zip(page_texts, page_areas)]
+    return text_pages if any(text is not None for text in text_pages) else None
+
+async def load_document_pages(file_path: str, filename: str, profile: dict, text_pages: Optional[List[Optional[str]]] = None) -> List[str]:
+    # Pages with a text layer are sent as text, only the runs of scanned pages between them are rasterised
+    if text_pages is None:
+        return await rasterise_document(file_path, filename, profile)
+    scanned_runs = []
+    for page_number, text in enumerate(text_pages, start=1):
+        if text is None:
+            if scanned_runs and scanned_runs[-1][1] == page_number - 1:
+                scanned_runs[-1][1] = page_number
+            else:
+                scanned_runs.append([page_number, page_number])
+    rendered_runs = await asyncio.gather(*(rasterise_document(file_path, filename, profile, first, last) for first, last in scanned_runs))
+    rendered_pages = iter(page for run in rendered_runs for page in run)
+    return [
+        f"--- Page {page_number} (text layer) ---\n{text}" if text is not None else next(rendered_pages)
+        for page_number, text in enumerate(text_pages, start=1)
+    ]
+
+def page_content_part(page: str) -> dict:
+    # A page is either the data URL of a rendered image or the text layer of a digital PDF page
+    if page.startswith("data:"):
+        return {"type": "image_url", "image_url": page}
+    return {"type": "text", "text": page}
+
+async def invoke_llm(messages: list, stage: str = "model_call", response_model=None) -> str:
+    # Native async call through the shared scheduler, so a slow model answer never blocks the event loop
+    # and a burst of applications stays within the model quota
+    options = {}
+    if response_model is not None and STRUCTURED_OUTPUT:
+        options = {"response_mime_type": "application/json", "response_json_schema": response_json_schema(response_model)}
+    try:
+        with stage_span(stage, current_document.get()):
+            response = await llm_scheduler.invoke(messages, timeout=LLM_TIMEOUT_SECONDS, **options)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"The AI model did not respond within {LLM_TIMEOUT_SECONDS:g} seconds.")
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    usage_log = token_usage_log.get()
+    if usage_log is not None:
+        usage = getattr(response, "usage_metadata", None) or {}
+        usage_log.append({
+            "stage": stage,
+            "document": current_document.get(),
+            "prompt_tokens": usage.get("input_tokens"),
+            "response_tokens": usage.get("output_tokens")
+        })
+    return response.content
+
+async def cancel_on_disconnect(request: Request, coro):
+    # Runs the coroutine as a task and cancels it (and every model call it is awaiting) once the client goes away
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected, processing was cancelled.")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def extraction_fingerprint() -> str:
+    # Everything besides the file bytes that changes what an extraction returns: prompts, model and pipeline settings
+    inputs = {
+        "version": PROMPT_VERSION,
+        "model": GEMINI_MODEL,
+        "prompts": [classification_prompt_template, text_classification_prompt, combined_extraction_prompt, field_repair_prompt, invalid_json_repair_prompt, extraction_prompts],
+        "structured_output": STRUCTURED_OUTPUT,
+        "single_call": SINGLE_CALL_EXTRACTION,
+        "image_profiles": IMAGE_PROFILES,
+        "document_image_profiles": DOCUMENT_IMAGE_PROFILES,
+        "text_layer": [TEXT_LAYER_EXTRACTION, TEXT_LAYER_MIN_CHARS, TEXT_LAYER_MIN_DENSITY, TEXT_LAYER_CLASSIFICATION_CHARS],
+        "chunking": [CHUNKED_EXTRACTION_THRESHOLDS, EXTRACTION_CHUNK_PAGES],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class ExtractionCache:
+    """Caches per-document extraction results by the SHA-256 of the file bytes and a fingerprint of the prompts, model and settings."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int, collection=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self.fingerprint = extraction_fingerprint()
+        self._entries = OrderedDict()
+
+    def key_for(self, content_hash: str) -> str:
+        return f"{content_hash}:{self.fingerprint}"
 
-    # 1. Classify
-    classification_message = HumanMessage(content=[{"type": "text", "text": classification_prompt_template}, {"type": "image_url", "image_url": pil_to_base64(images_to_process[0])}])
-    doc_type = llm.invoke([classification_message]).content.strip()
+    def _remember(self, key: str, result: dict):
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if time.monotonic() - stored_at < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                return copy.deepcopy(result)
+            del self._entries[key]
+
+        if self.collection is None:
+            return None
+        try:
+            # MongoDB's TTL monitor only runs once a minute, so expiry is also checked in the query
+            with stage_span("db_cache_lookup", current_document.get()):
+                record = await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logger.warning("Extraction cache lookup failed: %s", e)
+            return None
+        if record is None:
+            return None
+        self._remember(key, record["result"])
+        return copy.deepcopy(record["result"])
+
+    async def set(self, key: str, result: dict):
+        self._remember(key, copy.deepcopy(result))
+        if self.collection is None:
+            return
+        try:
+            now = datetime.now(timezone.utc)
+            with stage_span("db_cache_write", current_document.get()):
+                await self.collection.replace_one(
+                    {"_id": key},
+                    {"result": result, "created_at": now, "expires_at": datetime.fromtimestamp(now.timestamp() + self.ttl_seconds, timezone.utc)},
+                    upsert=True
+                )
+        except Exception as e:
+            logger.warning("Extraction cache write failed: %s", e)
+
+    async def ensure_indexes(self):
+        if self.collection is not None:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+# The MongoDB tier is attached by init_database() when EXTRACTION_CACHE_PERSIST is on
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_SIZE, EXTRACTION_CACHE_TTL_SECONDS)
+
+async def deactivate_duplicate_active_versions() -> int:
+    # Saves that raced before the unique index existed can have left several active versions of a document,
+    # which would make the index build fail. The newest one stays active.
+    pipeline = [
+        {"$match": {"is_active": True}},
+        {"$sort": {"start_date": -1, "_id": -1}},
+        {"$group": {"_id": {"application_id": "$application_id", "filename": "$filename"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ]
+    stale_ids = [stale_id async for group in verified_collection.aggregate(pipeline) for stale_id in group["ids"][1:]]
+    if stale_ids:
+        await verified_collection.update_many({"_id": {"$in": stale_ids}}, {"$set": {"is_active": False, "end_date": datetime.now(timezone.utc)}})
+        logger.warning("Deactivated %d duplicate active verified versions before creating the one_active_version index.", len(stale_ids))
+    return len(stale_ids)
+
+async def create_indexes() -> List[str]:
+    """Creates the indexes, returns the errors (logged as warnings) of those that could not be created."""
+    errors = []
+    try:
+        await extraction_cache.ensure_indexes()
+    except Exception as e:
+        logger.warning("Could not create extraction cache indexes: %s", e)
+        errors.append(f"extraction cache indexes: {e}")
+    try:
+        await verified_collection.create_index([("application_id", 1), ("filename", 1), ("is_active", 1)], name="application_filename_active")
+        # At most one active version per document, even when two saves race each other
+        if "one_active_version" not in await verified_collection.index_information():
+            await deactivate_duplicate_active_versions()
+            await verified_collection.create_index(
+                [("application_id", 1), ("filename", 1)],
+                name="one_active_version",
+                unique=True,
+                partialFilterExpression={"is_active": True}
+            )
+    except Exception as e:
+        logger.warning("Could not create verified document indexes: %s", e)
+        errors.append(f"verified document indexes: {e}")
+    return errors
+
+# --- NEW: Warm-up and readiness ---
+# Start-up only schedules the warm-up, so uvicorn binds its port right after the (light) import of this module.
+# The warm-up imports the model SDK and connects to MongoDB in the background; /ready reports it, and waits for
+# it up to READY_TIMEOUT_SECONDS, so a platform health check only routes traffic to a warm instance.
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "10"))
+warm_up_task: Optional[asyncio.Task] = None
+warm_up_status = {"model": {"status": "pending"}, "documents": {"status": "pending"}, "database": {"status": "pending"}}
+
+def load_model():
+    llm_scheduler.get_model()
+    human_message("")
+
+def load_document_libraries():
+    # Raster workers are forked from this process, so they start with these (and Pillow's format plugins) already imported
+    import PIL.Image, pdf2image, pypdf  # noqa: F401
+    PIL.Image.init()
+
+async def warm_up_model():
+    # Importing the Gemini SDK and langchain takes about a second of CPU, the thread keeps the event loop serving meanwhile
+    await asyncio.to_thread(load_model)
+
+async def warm_up_documents():
+    await asyncio.to_thread(load_document_libraries)
+
+async def warm_up_database():
+    await ensure_database()
+    await client.admin.command("ping")
+    # Without the one_active_version index concurrent saves can leave two active versions, so the instance is not ready
+    errors = await create_indexes()
+    if errors:
+        raise RuntimeError("Could not create indexes: " + "; ".join(errors))
+
+async def warm_up():
+    async def run_step(component: str, step):
+        started = time.perf_counter()
+        try:
+            with stage_span(f"warm_up_{component}"):
+                await step()
+            warm_up_status[component] = {"status": "ready", "seconds": round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            warm_up_status[component] = {"status": "failed", "error": str(getattr(e, "detail", None) or e)}
+            logger.warning("Warm-up of the %s failed: %s", component, e)
+
+    steps = {"model": warm_up_model, "documents": warm_up_documents, "database": warm_up_database}
+    await asyncio.gather(*(run_step(component, step) for component, step in steps.items() if warm_up_status[component]["status"] != "ready"))
+
+def is_ready() -> bool:
+    return all(component["status"] == "ready" for component in warm_up_status.values())
+
+def ensure_warm_up() -> asyncio.Task:
+    # A warm-up that failed (e.g. MongoDB was unreachable) is retried by the next readiness check
+    global warm_up_task
+    if warm_up_task is None or (warm_up_task.done() and not is_ready()):
+        warm_up_task = asyncio.create_task(warm_up())
+    return warm_up_task
+
+@app.on_event("startup")
+async def start_warm_up():
+    ensure_warm_up()
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+
+@app.get("/ready")
+async def get_readiness():
+    task = ensure_warm_up()
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout=READY_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    ready = is_ready()
+    status = "ready" if ready else "warming_up" if not task.done() else "not_ready"
+    return JSONResponse({"status": status, **warm_up_status}, status_code=200 if ready else 503)
+
+def validate_extraction_response(response_str: str, response_model) -> tuple:
+    try:
+        return validate_extraction(loads_tolerant(response_str), response_model)
+    except StructuredOutputError:
+        return None, []
+
+async def extract_structured(extraction_prompt: str, images: List[str], response_model) -> dict:
+    page_parts = [page_content_part(page) for page in images]
+    page_note = text_layer_note if any(part["type"] == "text" for part in page_parts) else ""
+    content_parts = [{"type": "text", "text": extraction_prompt + page_note}] + page_parts
+    response_str = await invoke_llm([human_message(content_parts)], stage="extraction", response_model=response_model)
+    result, failing_fields = validate_extraction_response(response_str, response_model)
+    if result is not None and not failing_fields:
+        return result
+
+    # One repair call: for the failing fields only when the rest of the answer is usable, otherwise for the whole answer
+    MODEL_OUTPUT_FAILURES.inc(stage="extraction", kind="parse" if result is None else "fields")
+    if result is None:
+        logger.warning("Extraction answer could not be parsed, asking the model again.")
+        repair_prompt, repair_model = extraction_prompt + invalid_json_repair_prompt, response_model
+    else:
+        logger.warning("Extraction answer failed validation for %s, asking the model for those fields again.", failing_fields)
+        repair_prompt = field_repair_prompt.format(fields=", ".join(f'"{field}"' for field in failing_fields))
+        repair_model = field_repair_model(tuple(failing_fields))
+    repair_parts = [{"type": "text", "text": repair_prompt + page_note}] + page_parts
+    repair_str = await invoke_llm([human_message(repair_parts)], stage="extraction_repair", response_model=repair_model)
+    repaired, still_failing = validate_extraction_response(repair_str, repair_model)
+    if repaired is None or still_failing:
+        MODEL_OUTPUT_FAILURES.inc(stage="extraction_repair", kind="parse" if repaired is None else "fields")
+
+    if result is None:
+        if repaired is None:
+            raise HTTPException(status_code=500, detail=f"AI returned a non-JSON response: {response_str}")
+        result = repaired
+    elif repaired is None:
+        still_failing = failing_fields
+    else:
+        for field in failing_fields:
+            if field not in still_failing:
+                result["extracted_data"][field] = repaired["extracted_data"][field]
+    if still_failing:
+        result["analysis"]["invalid_fields"] = still_failing
+    return result
+
+def discard_task(task: asyncio.Task):
+    # Cancels a speculative task we no longer need without leaving an unretrieved exception behind
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+async def speculative_profile_for(file_path: str, filename: str, text_pages: Optional[List[Optional[str]]]) -> Optional[dict]:
+    """
+    The profile to render with before the document type is known. Multi-page scans are mostly bank statements,
+    whose Statement profile can also be re-encoded down to the Default one; other documents are rendered with
+    the Default profile. None when there is nothing to render.
+    """
+    if text_pages is not None:
+        scanned_pages = sum(text is None for text in text_pages)
+    elif filename.endswith('.pdf'):
+        scanned_pages = await count_pdf_pages(file_path)
+    else:
+        scanned_pages = 1
+    if scanned_pages == 0:
+        return None
+    return IMAGE_PROFILES["Statement"] if scanned_pages > 1 else IMAGE_PROFILES["Default"]
+
+async def classify_then_extract(file_path: str, filename: str) -> tuple:
+    # 1. Classify, from the text of the first page when it has a text layer, otherwise from a low-resolution thumbnail
+    text_pages = await read_text_layer(file_path, filename)
+    if text_pages and text_pages[0] is not None:
+        classification_message = human_message(text_classification_prompt.format(page_text=text_pages[0][:TEXT_LAYER_CLASSIFICATION_CHARS]))
+    else:
+        thumbnail = await rasterise_document(file_path, filename, IMAGE_PROFILES["Thumbnail"], first_page=1, last_page=1)
+        if not thumbnail:
+             raise HTTPException(status_code=400, detail="Could not convert document to image.")
+        classification_message = human_message([{"type": "text", "text": classification_prompt_template}, {"type": "image_url", "image_url": thumbnail[0]}])
+
+    speculative_profile = await speculative_profile_for(file_path, filename, text_pages) if SPECULATIVE_RENDER else None
+    speculative_render = asyncio.ensure_future(load_document_pages(file_path, filename, speculative_profile, text_pages)) if speculative_profile else None
+    try:
+        doc_type = (await invoke_llm([classification_message], stage="classification")).strip()
+
+        # Pages are encoded with the image profile of the classified document type. The speculative render is
+        # used as is when it has that profile and re-encoded when it has a larger one of the same DPI; otherwise
+        # it is cancelled, which drops its page windows that have not started yet
+        extraction_profile = image_profile_for(doc_type)
+        if speculative_render is not None and extraction_profile == speculative_profile:
+            images_to_process = await speculative_render
+        elif speculative_render is not None and can_reencode(speculative_profile, extraction_profile):
+            started = time.perf_counter()
+            images_to_process, timings = await asyncio.get_running_loop().run_in_executor(get_raster_pool(), reencode_pages, await speculative_render, extraction_profile)
+            record_worker_timings(started, timings)
+        else:
+            if speculative_render is not None:
+                discard_task(speculative_render)
+            images_to_process = await load_document_pages(file_path, filename, extraction_profile, text_pages)
+    finally:
+        if speculative_render is not None:
+            discard_task(speculative_render)
 
     # 2. Extract
     extraction_prompt = extraction_prompts.get(doc_type, extraction_prompts["Default"])
-    content_parts = [{"type": "text", "text": extraction_prompt}]
-    for img in images_to_process:
-        content_parts.append({"type": "image_url", "image_url": pil_to_base64(img)})
-    
-    message = HumanMessage(content=content_parts)
-    response_json_string = llm.invoke([message]).content
-    
-    try:
-        clean_response = response_json_string.replace("```json", "").replace("```", "").strip()
-        final_result = json.loads(clean_response)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail=f"AI returned a non-JSON response: {response_json_string}")
+    extraction_model = extraction_models.get(doc_type, extraction_models["Default"])
+    final_result = await extract_from_pages(extraction_prompt, images_to_process, CHUNKED_EXTRACTION_THRESHOLDS.get(doc_type, CHUNKED_EXTRACTION_THRESHOLDS["Default"]), extraction_model)
+    return final_result, doc_type
+
+async def classify_and_extract_single_call(file_path: str, filename: str) -> tuple:
+    # The classifier's answer only selects an extraction prompt, so the model can do both in one round trip
+    text_pages = await read_text_layer(file_path, filename)
+    images_to_process = await load_document_pages(file_path, filename, IMAGE_PROFILES["Default"], text_pages)
+    if not images_to_process:
+         raise HTTPException(status_code=400, detail="Could not convert document to image.")
+
+    final_result = await extract_from_pages(combined_extraction_prompt, images_to_process, CHUNKED_EXTRACTION_THRESHOLDS["Default"], combined_extraction_model)
+    doc_type = str(final_result.pop("document_type", None) or "Other").strip()
+    return final_result, doc_type
+
+async def extract_from_pages(extraction_prompt: str, images_to_process: List[str], chunk_threshold: int, response_model) -> dict:
+    text_page_count = sum(not page.startswith("data:") for page in images_to_process)
+    PAGES_SENT.inc(text_page_count, form="text")
+    PAGES_SENT.inc(len(images_to_process) - text_page_count, form="image")
+    if len(images_to_process) <= chunk_threshold:
+        return await extract_structured(extraction_prompt, images_to_process, response_model)
+
+    # Long document: extract each page window concurrently, then merge the partial results
+    total_pages = len(images_to_process)
+    chunk_size = max(1, EXTRACTION_CHUNK_PAGES)
+    page_windows = [(first, min(first + chunk_size, total_pages)) for first in range(0, total_pages, chunk_size)]
+    chunk_results = await asyncio.gather(*(
+        extract_page_window(extraction_prompt, images_to_process[first:last], first + 1, last, total_pages, response_model)
+        for first, last in page_windows
+    ), return_exceptions=True)
+
+    for result in chunk_results:
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+    successful_chunks = [(window, result) for window, result in zip(page_windows, chunk_results) if not isinstance(result, BaseException)]
+    if not successful_chunks:
+        raise chunk_results[0]
+    merged_result = merge_chunk_results(successful_chunks)
+    failed_pages = [f"{first + 1}-{last}" for (first, last), result in zip(page_windows, chunk_results) if isinstance(result, BaseException)]
+    if failed_pages:
+        merged_result["analysis"]["failed_page_windows"] = failed_pages
+    return merged_result
+
+async def extract_page_window(extraction_prompt: str, window_images: List[str], first_page: int, last_page: int, total_pages: int, response_model) -> dict:
+    window_prompt = extraction_prompt + f"""
+    These images are pages {first_page}-{last_page} of a {total_pages}-page document. Extract the fields from these pages only and use null for a field that does not appear on them.
+    """
+    return await extract_structured(window_prompt, window_images, response_model)
+
+def field_confidence(details) -> float:
+    # Missing values always lose against present ones, whatever confidence the model gave them
+    if not isinstance(details, dict):
+        return 0.0 if details not in (None, "") else -1.0
+    if details.get("value") in (None, ""):
+        return -1.0
+    try:
+        return float(str(details.get("confidence", 0)).rstrip("%"))
+    except ValueError:
+        return 0.0
+
+def merge_chunk_results(chunks: List[tuple]) -> dict:
+    # Keeps the highest-confidence value per field; on a tie the earliest page window wins,
+    # so the same chunk results always merge to the same answer.
+    merged_data = {}
+    chunk_analyses = []
+    for (first, last), result in chunks:
+        for field, details in (result.get("extracted_data") or {}).items():
+            if field not in merged_data or field_confidence(details) > field_confidence(merged_data[field]):
+                merged_data[field] = details
+        chunk_analyses.append({"pages": f"{first + 1}-{last}", "analysis": result.get("analysis")})
+
+    merged_result = {"extracted_data": merged_data, "analysis": {"page_windows": chunk_analyses}}
+    # The single-call prompt also returns the document type, the first window that names one decides it
+    document_types = [result.get("document_type") for _, result in chunks if result.get("document_type")]
+    if document_types:
+        merged_result["document_type"] = document_types[0]
+    return merged_result
+
+def hash_file(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+async def process_single_file(file_path: str, filename: str, content_hash: Optional[str] = None) -> dict:
+    if not filename.endswith(('.pdf', '.png', '.jpg', '.jpeg')):
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {filename}")
+
+    # Re-uploads of the same document skip rasterisation and both model calls
+    cache_key = extraction_cache.key_for(content_hash or await asyncio.to_thread(hash_file, file_path))
+    cached_result = await extraction_cache.get(cache_key)
+    EXTRACTION_CACHE_REQUESTS.inc(result="miss" if cached_result is None else "hit")
+    if cached_result is not None:
+        cached_result['filename'] = filename
+        cached_result['from_cache'] = True
+        return cached_result
+
+    if SINGLE_CALL_EXTRACTION:
+        final_result, doc_type = await classify_and_extract_single_call(file_path, filename)
+    else:
+        final_result, doc_type = await classify_then_extract(file_path, filename)
 
     # --- FIX: The document type from the AI might be different from our specific keys ---
     # We should add the *actual* type returned by the classifier to the result
     final_result['document_type'] = doc_type
+    # A result missing page windows (e.g. a rate limit outlasting the retries) is not cached, the next upload tries again
+    analysis = final_result.get('analysis')
+    if not (isinstance(analysis, dict) and analysis.get('failed_page_windows')):
+        await extraction_cache.set(cache_key, final_result)
     final_result['filename'] = filename
+    final_result['from_cache'] = False
     return final_result
 
-@app.post("/process-application/")
-async def process_application(files: List[UploadFile] = File(...)):
+class SpooledUpload:
+    """An uploaded file copied to a temp file on disk, hashed while it was being written."""
+
+    def __init__(self, filename: str, path: str, sha256: str, size: int):
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+def remove_spooled_uploads(uploads: List[SpooledUpload]):
+    for upload in uploads:
+        try:
+            os.remove(upload.path)
+        except OSError:
+            pass
+
+async def spool_uploads(files: List[UploadFile]) -> List[SpooledUpload]:
+    # Copies each upload to disk chunk by chunk so a package is never held in memory as a whole
+    uploads = []
+    request_bytes = 0
     try:
-        application_id = str(uuid.uuid4())
-        application_results = []
         for file in files:
-            file_content = await file.read()
-            single_result = await process_single_file(file_content, file.filename.lower())
-            application_results.append(single_result)
-        
-        summarized_data_for_ai = [{"filename": res.get('filename'), "document_type": res.get('document_type'), "data": res.get('extracted_data')} for res in application_results]
-        
-        cross_val_message = HumanMessage(content=cross_validation_prompt.format(summarized_data=json.dumps(summarized_data_for_ai, indent=2)))
-        cross_val_response_str = llm.invoke([cross_val_message]).content
-        
-        try:
-            json_match = re.search(r'\{.*\}', cross_val_response_str, re.DOTALL)
-            cross_val_json = json.loads(json_match.group(0)) if json_match else {}
-        except json.JSONDecodeError:
-            cross_val_json = {"overall_summary": "AI cross-validation returned an invalid format.", "validation_passed": False}
-
-        complete_data_for_summary = { 
-            "individual_documents": application_results,
-            "initial_cross_validation": cross_val_json
-        }
-        summary_message = HumanMessage(content=final_summary_prompt.format(complete_data=json.dumps(complete_data_for_summary, indent=2)))
-        summary_response_str = llm.invoke([summary_message]).content
+            filename = file.filename.lower()
+            sha256 = hashlib.sha256()
+            size = 0
+            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1], dir=UPLOAD_SPOOL_DIR) as spooled:
+                uploads.append(SpooledUpload(filename, spooled.name, "", 0))
+                while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                    size += len(chunk)
+                    request_bytes += len(chunk)
+                    if size > MAX_FILE_BYTES:
+                        raise HTTPException(status_code=413, detail=f"{filename} is larger than the {MAX_FILE_BYTES // (1024 * 1024)} MB per-file limit.")
+                    if request_bytes > MAX_REQUEST_BYTES:
+                        raise HTTPException(status_code=413, detail=f"The uploaded package is larger than the {MAX_REQUEST_BYTES // (1024 * 1024)} MB limit.")
+                    sha256.update(chunk)
+                    spooled.write(chunk)
+            uploads[-1].sha256 = sha256.hexdigest()
+            uploads[-1].size = size
+    except BaseException:
+        remove_spooled_uploads(uploads)
+        raise
+    return uploads
+
+# --- NEW: Gzip-compressed request bodies (the Streamlit client compresses its multipart uploads) ---
+class GzipRequestMiddleware:
+    """Decompresses request bodies sent with Content-Encoding: gzip before they reach the form or JSON parser."""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(name == b"content-encoding" and value.strip().lower() == b"gzip" for name, value in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        # The decompressed length is not known up front, so Content-Length goes with Content-Encoding
+        scope = {**scope, "headers": [(name, value) for name, value in scope["headers"] if name not in (b"content-encoding", b"content-length")]}
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decompressed_bytes = 0
 
+        async def receive_decompressed():
+            nonlocal decompressed_bytes
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            chunks = []
+            compressed = message.get("body", b"")
+            try:
+                # Output is produced in bounded steps, so a small, highly compressed body cannot expand in memory all at once
+                while compressed:
+                    chunk = decompressor.decompress(compressed, UPLOAD_CHUNK_BYTES)
+                    compressed = decompressor.unconsumed_tail
+                    decompressed_bytes += len(chunk)
+                    if decompressed_bytes > self.max_bytes:
+                        raise HTTPException(status_code=413, detail=f"The uploaded package is larger than the {MAX_REQUEST_BYTES // (1024 * 1024)} MB limit.")
+                    chunks.append(chunk)
+                if not message.get("more_body", False):
+                    chunks.append(decompressor.flush())
+            except zlib.error:
+                raise HTTPException(status_code=400, detail="The request body is not valid gzip.")
+            return {**message, "body": b"".join(chunks)}
+
+        await self.app(scope, receive_decompressed, send)
+
+# Multipart boundaries and headers come on top of the file bytes
+app.add_middleware(GzipRequestMiddleware, max_bytes=MAX_REQUEST_BYTES + UPLOAD_CHUNK_BYTES)
+
+async def process_file_bounded(semaphore: asyncio.Semaphore, index: int, upload: SpooledUpload, on_progress: Optional[Callable] = None) -> dict:
+    # A failure in one file is reported in its own result so the rest of the package still goes through.
+    async with semaphore:
+        # Each file runs in its own task, so this only labels the model calls made for this file
+        current_document.set(upload.filename)
+        if on_progress:
+            on_progress(index, "processing")
         try:
-            json_match = re.search(r'\{.*\}', summary_response_str, re.DOTALL)
-            summary_json = json.loads(json_match.group(0)) if json_match else {}
-        except json.JSONDecodeError:
-            summary_json = {"final_recommendation": "Error", "overall_summary": "AI failed to generate a final summary report."}
+            with stage_span("document", upload.filename):
+                result = await process_single_file(upload.path, upload.filename, upload.sha256)
+        except HTTPException as e:
+            result = {"filename": upload.filename, "document_type": "Error", "error": str(e.detail)}
+        except Exception as e:
+            result = {"filename": upload.filename, "document_type": "Error", "error": f"Failed to process document: {str(e)}"}
+        DOCUMENTS_PROCESSED.inc(outcome="error" if "error" in result else "cached" if result.get("from_cache") else "processed")
+        if on_progress:
+            on_progress(index, "error" if "error" in result else "done", result)
+        return result
+
+# --- NEW: Compact payloads for the cross-validation and summary prompts ---
+
+def compact_json(data) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def estimate_text_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+def field_values(extracted_data: Optional[dict], max_chars: Optional[int] = None) -> dict:
+    # {"Name": {"value": "X", "confidence": 0.9}} -> {"Name": "X"}
+    values = {}
+    for field, details in (extracted_data or {}).items():
+        value = details.get("value") if isinstance(details, dict) else details
+        if max_chars and isinstance(value, str) and len(value) > max_chars:
+            value = value[:max_chars] + "…"
+        values[field] = value
+    return values
+
+def low_confidence_fields(extracted_data: Optional[dict]) -> List[str]:
+    return [field for field, details in (extracted_data or {}).items() if isinstance(details, dict) and 0 <= field_confidence(details) < 0.75]
+
+IDENTITY_FIELD_MARKERS = ("name", "birth", "dob", "pan", "aadhaar")
+
+def build_cross_validation_payloads(results: List[dict]) -> List[str]:
+    # Candidate payloads from richest to smallest; the cross-check only needs field values, never confidences or analysis
+    full = [{"file": res.get("filename"), "type": res.get("document_type"), "data": field_values(res.get("extracted_data"))} for res in results]
+    identity_only = [
+        {**doc, "data": {field: value for field, value in field_values(res.get("extracted_data"), 80).items() if any(marker in field.lower() for marker in IDENTITY_FIELD_MARKERS)}}
+        for doc, res in zip(full, results)
+    ]
+    return [compact_json(full), compact_json(identity_only)]
+
+def build_summary_payloads(results: List[dict], cross_val_json: dict) -> List[str]:
+    cross_validation = {"summary": cross_val_json.get("overall_summary"), "passed": cross_val_json.get("validation_passed")}
+
+    def documents(analysis_chars: int, value_chars: Optional[int]) -> List[dict]:
+        docs = []
+        for res in results:
+            if "error" in res:
+                docs.append({"file": res.get("filename"), "error": res["error"]})
+                continue
+            doc = {"file": res.get("filename"), "type": res.get("document_type"), "data": field_values(res.get("extracted_data"), value_chars)}
+            if res.get("human_verified"):
+                doc["verified_by_human"] = True
+            low_confidence = low_confidence_fields(res.get("extracted_data"))
+            if low_confidence:
+                doc["low_confidence"] = low_confidence
+            if analysis_chars and res.get("analysis"):
+                analysis = compact_json(res["analysis"])
+                doc["analysis"] = analysis if len(analysis) <= analysis_chars else analysis[:analysis_chars] + "…"
+            docs.append(doc)
+        return docs
 
+    return [
+        compact_json({"documents": documents(ANALYSIS_CHAR_LIMIT, None), "cross_validation": cross_validation}),
+        compact_json({"documents": documents(ANALYSIS_CHAR_LIMIT // 4, 200), "cross_validation": cross_validation}),
+        compact_json({"documents": documents(0, 80), "cross_validation": cross_validation}),
+    ]
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a payload does not fit its token budget even with every value truncated."""
+
+def truncate_values(data, max_chars: int, max_items: int, depth: int = 0):
+    # The outer lists (the documents themselves) are kept whole, only the values inside a document are cut
+    if isinstance(data, str):
+        return data if len(data) <= max_chars else data[:max_chars] + "…"
+    if isinstance(data, dict):
+        return {key: truncate_values(value, max_chars, max_items, depth + 1) for key, value in data.items()}
+    if isinstance(data, list):
+        items = data if depth <= 1 else data[:max_items]
+        truncated = [truncate_values(item, max_chars, max_items, depth + 1) for item in items]
+        return truncated + ([f"… {len(data) - len(items)} more"] if len(items) < len(data) else [])
+    return data
+
+def fit_to_token_budget(candidates: List[str], token_budget: int, stage: str) -> str:
+    for payload in candidates:
+        if estimate_text_tokens(payload) <= token_budget:
+            return payload
+    # Even the smallest candidate is too large: keep cutting every value (and long lists inside a document) shorter
+    smallest = json.loads(candidates[-1])
+    for max_chars, max_items in ((40, 10), (20, 5), (10, 2)):
+        payload = compact_json(truncate_values(smallest, max_chars, max_items))
+        if estimate_text_tokens(payload) <= token_budget:
+            logger.warning("%s payload only fits its budget of %d tokens with values cut to %d characters.", stage, token_budget, max_chars)
+            return payload
+    raise TokenBudgetExceeded(f"The {stage} payload is ~{estimate_text_tokens(payload)} tokens, over its budget of {token_budget} even with every value truncated.")
+
+def summarise_token_usage(usage_log: List[dict]) -> dict:
+    return {
+        "prompt_tokens": sum(call["prompt_tokens"] or 0 for call in usage_log),
+        "response_tokens": sum(call["response_tokens"] or 0 for call in usage_log),
+        "calls": usage_log
+    }
+
+def parse_cross_validation_response(response_str: str) -> dict:
+    report = parse_model_answer(response_str, CrossValidationReport)
+    if report is None:
+        MODEL_OUTPUT_FAILURES.inc(stage="cross_validation", kind="parse")
+        return {"overall_summary": "AI cross-validation returned an invalid format.", "validation_passed": False}
+    return report
+
+async def cross_validate_with_model(results: List[dict]) -> dict:
+    try:
+        cross_val_payload = fit_to_token_budget(build_cross_validation_payloads(results), CROSS_VALIDATION_TOKEN_BUDGET, "cross_validation")
+    except TokenBudgetExceeded as e:
+        # The rules only send the comparisons they could not decide, a much smaller payload
+        logger.warning("%s Cross-validating with the rules instead.", e)
+        return await cross_validate_with_rules(results)
+    cross_val_message = human_message(cross_validation_prompt.format(summarized_data=cross_val_payload))
+    return parse_cross_validation_response(await invoke_llm([cross_val_message], stage="cross_validation", response_model=CrossValidationReport))
+
+async def cross_validate_with_rules(results: List[dict]) -> dict:
+    with stage_span("rule_validation"):
+        report = validate_application(results)
+    undecided = report.pop("undecided")
+    # A failed rule already decides the outcome, so the model is only asked when nothing else failed
+    if not undecided or any(check["status"] == "fail" for check in report["checks"]):
+        return report
+
+    undecided_checks = compact_json([{"check": check["check"], "values": check["values"], "note": check["detail"]} for check in undecided])
+    message = human_message(undecided_cross_validation_prompt.format(undecided_checks=undecided_checks))
+    model_verdict = parse_cross_validation_response(await invoke_llm([message], stage="cross_validation", response_model=CrossValidationReport))
+    model_passed = model_verdict.get("validation_passed") is True
+    for check in undecided:
+        check["status"] = "pass" if model_passed else "fail"
+        check["decided_by"] = "model"
+    report["overall_summary"] = " ".join(filter(None, [report["overall_summary"], model_verdict.get("overall_summary")]))
+    report["validation_passed"] = model_passed
+    report["decided_by"] = "rules+model"
+    return report
+
+async def run_application_pipeline(application_id: str, uploads: List[SpooledUpload], on_progress: Optional[Callable] = None, include_timings: bool = False, trace: Optional[ApplicationTrace] = None) -> dict:
+    # Every stage span recorded while this application is processed is added to its trace. A caller that
+    # records spans of its own around the pipeline (spooling, storing) passes the trace it started.
+    trace = trace or ApplicationTrace(application_id)
+    current_trace.set(trace)
+    try:
+        result = await process_application_package(application_id, uploads, on_progress)
+    finally:
+        APPLICATION_SECONDS.observe(time.perf_counter() - trace.started)
+        logger.info("Application %s stage timings: %s", application_id, compact_json(trace.summary()["stages"]))
+    if include_timings:
+        result["timings"] = trace.summary()
+    return result
+
+async def process_application_package(application_id: str, uploads: List[SpooledUpload], on_progress: Optional[Callable] = None) -> dict:
+    usage_log = []
+    token_usage_log.set(usage_log)
+    semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_FILES))
+    # gather() keeps the results in upload order
+    application_results = await asyncio.gather(*(
+        process_file_bounded(semaphore, index, upload, on_progress)
+        for index, upload in enumerate(uploads)
+    ))
+    return await review_application(application_id, application_results, usage_log)
+
+async def review_application(application_id: str, application_results: List[dict], usage_log: List[dict], verified_data: Optional[Dict[str, dict]] = None) -> dict:
+    """
+    Cross-validation and the final summary of an application's processed documents. With ``verified_data``
+    (filename -> field -> value) the human-verified values are used in place of the extracted ones.
+    """
+    review_results = apply_verified_data(application_results, verified_data or {})
+    successful_results = [res for res in review_results if "error" not in res]
+    verified_documents = {"verified_documents": sorted(verified_data)} if verified_data is not None else {}
+
+    if not successful_results:
         return {
             "application_id": application_id,
             "individual_document_results": application_results,
-            "cross_validation_report": cross_val_json,
-            "final_summary_report": summary_json
+            "cross_validation_report": {"overall_summary": "No document could be processed, cross-validation was skipped.", "validation_passed": False},
+            "final_summary_report": {"final_recommendation": "Error", "overall_summary": "None of the uploaded documents could be processed."},
+            "token_usage": summarise_token_usage(usage_log),
+            **verified_documents
         }
+
+    if CROSS_VALIDATION_MODE == "rules":
+        cross_val_json = await cross_validate_with_rules(successful_results)
+    else:
+        cross_val_json = await cross_validate_with_model(successful_results)
+
+    try:
+        summary_payload = fit_to_token_budget(build_summary_payloads(review_results, cross_val_json), SUMMARY_TOKEN_BUDGET, "final_summary")
+    except TokenBudgetExceeded as e:
+        logger.warning("%s Skipping the final summary of application %s.", e, application_id)
+        summary_payload = None
+        summary_json = {
+            "final_recommendation": "Manual Review Required",
+            "overall_summary": f"The application has too much extracted data for an automated summary within SUMMARY_TOKEN_BUDGET ({SUMMARY_TOKEN_BUDGET} tokens), review the documents individually.",
+            "key_financial_metrics": [],
+            "consolidated_red_flags": []
+        }
+    if summary_payload is not None:
+        summary_message = human_message(final_summary_prompt.format(complete_data=summary_payload))
+        summary_response_str = await invoke_llm([summary_message], stage="final_summary", response_model=FinalSummaryReport)
+        summary_json = parse_model_answer(summary_response_str, FinalSummaryReport)
+        if summary_json is None:
+            MODEL_OUTPUT_FAILURES.inc(stage="final_summary", kind="parse")
+            summary_json = {"final_recommendation": "Error", "overall_summary": "AI failed to generate a final summary report."}
+
+    return {
+        "application_id": application_id,
+        "individual_document_results": application_results,
+        "cross_validation_report": cross_val_json,
+        "final_summary_report": summary_json,
+        "token_usage": summarise_token_usage(usage_log),
+        **verified_documents
+    }
+
+def apply_verified_data(application_results: List[dict], verified_data: Dict[str, dict]) -> List[dict]:
+    # The stored results keep the AI's values (the dashboard measures accuracy against them), only the review sees the verified ones
+    review_results = []
+    for res in application_results:
+        verified_fields = verified_data.get(res.get("filename"))
+        if verified_fields and "error" not in res:
+            res = copy.deepcopy(res)
+            extracted_data = res.setdefault("extracted_data", {})
+            for field, value in verified_fields.items():
+                extracted_data[field] = {"value": value, "confidence": 1.0, "verified": True}
+            res["human_verified"] = True
+        review_results.append(res)
+    return review_results
+
+@app.post("/process-application/")
+async def process_application(request: Request, files: List[UploadFile] = File(...), include_timings: bool = False):
+    try:
+        application_id = str(uuid.uuid4())
+        # The trace starts before spooling, so the spooling and storing spans are part of it too
+        trace = ApplicationTrace(application_id)
+        current_trace.set(trace)
+        with stage_span("upload_spool"):
+            uploads = await spool_uploads(files)
+        try:
+            result = await cancel_on_disconnect(request, run_application_pipeline(application_id, uploads, trace=trace))
+            await persist_processed_application(application_id, uploads, result)
+            if include_timings:
+                result["timings"] = trace.summary()
+            return result
+        finally:
+            remove_spooled_uploads(uploads)
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during application processing: {str(e)}")
 
 
+# --- NEW: Asynchronous job API (submit, poll status, stream results) ---
+
+class ApplicationJob:
+    """One submitted application: per-document progress plus an append-only event log for streaming clients."""
+
+    def __init__(self, application_id: str, uploads: List[SpooledUpload]):
+        self.application_id = application_id
+        self.uploads = uploads
+        self.status = "queued"
+        self.documents = [{"filename": upload.filename, "status": "pending"} for upload in uploads]
+        self.result = None
+        self.error = None
+        self.submitted_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.events = []
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def publish(self, event: str, data: dict):
+        self.events.append({"event": event, "data": data})
+        # Wake everyone waiting on the current event and start a fresh one for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_events(self, seen: int, timeout: float):
+        changed = self._changed
+        if len(self.events) > seen or self.finished:
+            return
+        await asyncio.wait_for(changed.wait(), timeout=timeout)
+
+    def on_progress(self, index: int, status: str, result: Optional[dict] = None):
+        self.documents[index]["status"] = status
+        if result is not None:
+            self.documents[index]["document_type"] = result.get("document_type")
+            self.publish("document", {"index": index, **result})
+
+    def status_report(self) -> dict:
+        finished_documents = sum(1 for doc in self.documents if doc["status"] in ("done", "error"))
+        return {
+            "application_id": self.application_id,
+            "status": self.status,
+            "documents_total": len(self.documents),
+            "documents_finished": finished_documents,
+            "documents": self.documents,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result
+        }
+
+jobs: Dict[str, ApplicationJob] = {}
+job_queue: Optional[asyncio.Queue] = None
+job_worker_tasks: List[asyncio.Task] = []
+
+async def run_job(job: ApplicationJob):
+    job.status = "processing"
+    try:
+        job.result = await run_application_pipeline(job.application_id, job.uploads, job.on_progress)
+        await persist_processed_application(job.application_id, job.uploads, job.result)
+        job.status = "completed"
+        job.publish("completed", job.result)
+    except Exception as e:
+        job.error = str(e.detail) if isinstance(e, HTTPException) else f"An unexpected error occurred during application processing: {str(e)}"
+        job.status = "failed"
+        job.publish("failed", {"application_id": job.application_id, "error": job.error})
+    finally:
+        job.finished_at = datetime.now(timezone.utc)
+        # The pipeline is done with the spooled files, only results are kept around
+        remove_spooled_uploads(job.uploads)
+        job.uploads = []
+
+async def job_worker():
+    while True:
+        job = await job_queue.get()
+        try:
+            await run_job(job)
+        finally:
+            job_queue.task_done()
+
+@app.on_event("startup")
+async def start_job_workers():
+    global job_queue
+    job_queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    for _ in range(max(1, JOB_WORKERS)):
+        job_worker_tasks.append(asyncio.create_task(job_worker()))
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    for task in job_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    job_worker_tasks.clear()
+
+def purge_finished_jobs():
+    now = datetime.now(timezone.utc)
+    expired = [job_id for job_id, job in jobs.items() if job.finished and (now - job.finished_at).total_seconds() > JOB_RETENTION_SECONDS]
+    for job_id in expired:
+        del jobs[job_id]
+
+def get_job(application_id: str) -> ApplicationJob:
+    job = jobs.get(application_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No application job found with ID {application_id}.")
+    return job
+
+@app.post("/applications/", status_code=202)
+async def submit_application(files: List[UploadFile] = File(...)):
+    purge_finished_jobs()
+    application_id = str(uuid.uuid4())
+    job = ApplicationJob(application_id, await spool_uploads(files))
+    try:
+        job_queue.put_nowait(job)
+    except asyncio.QueueFull:
+        remove_spooled_uploads(job.uploads)
+        raise HTTPException(status_code=503, detail="Too many applications are queued for processing, please retry shortly.")
+    jobs[application_id] = job
+    return {
+        "application_id": application_id,
+        "status": job.status,
+        "status_url": f"/applications/{application_id}/status",
+        "events_url": f"/applications/{application_id}/events"
+    }
+
+@app.get("/applications/{application_id}/status")
+async def get_application_status(application_id: str):
+    return get_job(application_id).status_report()
+
+@app.get("/applications/{application_id}/events")
+async def stream_application_events(application_id: str, request: Request):
+    job = get_job(application_id)
+
+    async def event_stream():
+        # Replays everything published so far, then pushes each new event as it happens (Server-Sent Events)
+        seen = 0
+        while True:
+            try:
+                await job.wait_for_events(seen, SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+            for event in job.events[seen:]:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+            seen = len(job.events)
+            if job.finished and seen == len(job.events):
+                return
+            if await request.is_disconnected():
+                return
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- NEW: Stored applications, updated document by document ---
+# Every processed application is kept in the "applications" collection with the result of each document.
+# Documents can then be added, replaced or removed one at a time: only new or changed files are extracted,
+# and cross-validation and the final summary are recomputed from the stored results and the active
+# human-verified values.
+
+APPLICATION_CONFLICT_DETAIL = "The application was changed by another request at the same time, reload it and try again."
+
+def stored_document(upload: SpooledUpload, result: dict) -> dict:
+    return {"filename": upload.filename, "content_hash": upload.sha256, "result": result}
+
+def application_record(documents: List[dict], review: dict) -> dict:
+    return {
+        "documents": documents,
+        "cross_validation_report": review["cross_validation_report"],
+        "final_summary_report": review["final_summary_report"],
+        "verified_documents": review.get("verified_documents", []),
+        "updated_at": datetime.now(timezone.utc)
+    }
+
+async def persist_processed_application(application_id: str, uploads: List[SpooledUpload], result: dict):
+    # Storing is best effort: the package was processed and its result is returned even when MongoDB is unavailable
+    try:
+        await ensure_database()
+        record = application_record([stored_document(upload, res) for upload, res in zip(uploads, result["individual_document_results"])], result)
+        with stage_span("db_save_application"):
+            await applications_collection.replace_one(
+                {"_id": application_id},
+                {**record, "created_at": record["updated_at"], "version": 1},
+                upsert=True
+            )
+    except Exception as e:
+        logger.warning("Could not store application %s: %s", application_id, getattr(e, "detail", None) or e)
+
+async def load_application(application_id: str) -> dict:
+    await ensure_database()
+    with stage_span("db_load_application"):
+        record = await applications_collection.find_one({"_id": application_id})
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"No stored application found with ID {application_id}.")
+    return record
+
+async def active_verified_data(application_id: str, excluded_filenames: List[str] = ()) -> Dict[str, dict]:
+    cursor = verified_collection.find({"application_id": application_id, "is_active": True}, {"filename": 1, "verified_data": 1})
+    return {doc["filename"]: doc.get("verified_data") or {} async for doc in cursor if doc["filename"] not in excluded_filenames}
+
+async def deactivate_verified_data(application_id: str, filenames: List[str]):
+    # The verified values of a replaced or removed file describe a document that is no longer part of the application
+    with stage_span("db_save_verified"):
+        await verified_collection.update_many(
+            {"application_id": application_id, "filename": {"$in": list(filenames)}, "is_active": True},
+            {"$set": {"is_active": False, "end_date": datetime.now(timezone.utc)}}
+        )
+
+async def update_application(record: dict, uploads: List[SpooledUpload] = (), removed_filenames: List[str] = ()) -> dict:
+    application_id = record["_id"]
+    documents = {doc["filename"]: doc for doc in record["documents"]}
+    for filename in removed_filenames:
+        if documents.pop(filename, None) is None:
+            raise HTTPException(status_code=404, detail=f"Application {application_id} has no document named {filename}.")
+    if not documents and not uploads:
+        raise HTTPException(status_code=400, detail="An application needs at least one document, submit a new application instead.")
+
+    # A file with the same name and content as a stored, successfully processed one keeps its result
+    changed_uploads = [
+        upload for upload in uploads
+        if upload.filename not in documents
+        or documents[upload.filename]["content_hash"] != upload.sha256
+        or "error" in documents[upload.filename]["result"]
+    ]
+    if not changed_uploads and not removed_filenames:
+        return {**stored_application_response(record), "reprocessed_documents": []}
+    stale_filenames = list(removed_filenames) + [
+        upload.filename for upload in changed_uploads
+        if upload.filename in documents and documents[upload.filename]["content_hash"] != upload.sha256
+    ]
+
+    usage_log = []
+    token_usage_log.set(usage_log)
+    semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_FILES))
+    results = await asyncio.gather(*(process_file_bounded(semaphore, index, upload) for index, upload in enumerate(changed_uploads)))
+    for upload, result in zip(changed_uploads, results):
+        documents[upload.filename] = stored_document(upload, result)
+
+    verified_data = await active_verified_data(application_id, excluded_filenames=stale_filenames)
+    review = await review_application(application_id, [doc["result"] for doc in documents.values()], usage_log, verified_data)
+    # The version read above must still be the stored one, otherwise a concurrent update would be lost
+    with stage_span("db_save_application"):
+        outcome = await applications_collection.update_one(
+            {"_id": application_id, "version": record["version"]},
+            {"$set": application_record(list(documents.values()), review), "$inc": {"version": 1}}
+        )
+    if outcome.matched_count == 0:
+        raise HTTPException(status_code=409, detail=APPLICATION_CONFLICT_DETAIL)
+    # Only once the update is stored, so a rejected update leaves the verifications in place
+    if stale_filenames:
+        await deactivate_verified_data(application_id, stale_filenames)
+    return {**review, "reprocessed_documents": [upload.filename for upload in changed_uploads]}
+
+def stored_application_response(record: dict) -> dict:
+    return {
+        "application_id": record["_id"],
+        "individual_document_results": [doc["result"] for doc in record["documents"]],
+        "cross_validation_report": record.get("cross_validation_report"),
+        "final_summary_report": record.get("final_summary_report"),
+        "verified_documents": record.get("verified_documents", []),
+        "created_at": record.get("created_at"),
+        "updated_at": record.get("updated_at"),
+        "version": record.get("version")
+    }
+
+@app.get("/applications/{application_id}")
+async def get_application(application_id: str):
+    return stored_application_response(await load_application(application_id))
+
+@app.put("/applications/{application_id}/documents")
+async def put_application_documents(application_id: str, files: List[UploadFile] = File(...)):
+    # Adds the files to the application, or replaces the stored documents with the same file name
+    record = await load_application(application_id)
+    with stage_span("upload_spool"):
+        uploads = await spool_uploads(files)
+    try:
+        return await update_application(record, uploads=uploads)
+    finally:
+        remove_spooled_uploads(uploads)
+
+@app.delete("/applications/{application_id}/documents/{filename}")
+async def delete_application_document(application_id: str, filename: str):
+    record = await load_application(application_id)
+    return await update_application(record, removed_filenames=[filename.lower()])
+
+@app.post("/applications/{application_id}/review")
+async def review_stored_application(application_id: str):
+    # Recomputes cross-validation and the summary from the stored results, e.g. after verified data was saved
+    record = await load_application(application_id)
+    usage_log = []
+    token_usage_log.set(usage_log)
+    review = await review_application(application_id, [doc["result"] for doc in record["documents"]], usage_log, await active_verified_data(application_id))
+    with stage_span("db_save_application"):
+        outcome = await applications_collection.update_one(
+            {"_id": application_id, "version": record["version"]},
+            {"$set": application_record(record["documents"], review), "$inc": {"version": 1}}
+        )
+    if outcome.matched_count == 0:
+        raise HTTPException(status_code=409, detail=APPLICATION_CONFLICT_DETAIL)
+    return {**review, "reprocessed_documents": []}
+
+
+@app.get("/scheduler-stats/")
+async def get_scheduler_stats():
+    return llm_scheduler.stats()
+
+
 class VerificationPayload(BaseModel):
     application_id: str
     filename: str
     original_ai_data: Dict[str, Any]
     verified_data: Dict[str, str]
 
+class VerifiedDocument(BaseModel):
+    filename: str
+    original_ai_data: Dict[str, Any]
+    verified_data: Dict[str, str]
+
+class ApplicationVerificationPayload(BaseModel):
+    application_id: str
+    documents: List[VerifiedDocument]
+
+# Transactions need a replica set (Atlas always has one); on a standalone server we fall back to
+# an ordered bulk write guarded by the one_active_version unique index.
+mongo_transactions_supported = True
+SAVE_CONFLICT_RETRIES = 3
+
+def versioning_operations(application_id: str, documents: List[VerifiedDocument]) -> tuple:
+    from bson import ObjectId
+    from pymongo import InsertOne, UpdateMany
+    now = datetime.now(timezone.utc)
+    operations = []
+    inserted_ids = []
+    for document in documents:
+        inserted_ids.append(ObjectId())
+        operations.append(UpdateMany(
+            {"application_id": application_id, "filename": document.filename, "is_active": True},
+            {"$set": {"is_active": False, "end_date": now}}
+        ))
+        operations.append(InsertOne({
+            "_id": inserted_ids[-1],
+            "application_id": application_id,
+            "filename": document.filename,
+            "ai_data": document.original_ai_data.get("extracted_data", {}),
+            "verified_data": document.verified_data,
+            "start_date": now,
+            "end_date": None,
+            "is_active": True
+        }))
+    return operations, inserted_ids
+
+async def save_verified_versions(application_id: str, documents: List[VerifiedDocument]) -> list:
+    with stage_span("db_save_verified"):
+        return await write_verified_versions(application_id, documents)
+
+async def write_verified_versions(application_id: str, documents: List[VerifiedDocument]) -> list:
+    # Deactivating the old versions and inserting the new ones is one ordered bulk write (one round trip),
+    # run inside a transaction when the server supports it. Returns the IDs of the inserted records.
+    from pymongo.errors import BulkWriteError, OperationFailure
+    global mongo_transactions_supported
+    if mongo_transactions_supported:
+        try:
+            async with await client.start_session() as session:
+                async def write_versions(session):
+                    operations, inserted_ids = versioning_operations(application_id, documents)
+                    await verified_collection.bulk_write(operations, ordered=True, session=session)
+                    return inserted_ids
+                return await session.with_transaction(write_versions)
+        except OperationFailure as e:
+            # IllegalOperation: "Transaction numbers are only allowed on a replica set member or mongos"
+            if e.code != 20:
+                raise
+            mongo_transactions_supported = False
+            logger.warning("MongoDB transactions are not supported by this deployment, using bulk writes only.")
+
+    for attempt in range(SAVE_CONFLICT_RETRIES + 1):
+        operations, inserted_ids = versioning_operations(application_id, documents)
+        try:
+            await verified_collection.bulk_write(operations, ordered=True)
+            return inserted_ids
+        except BulkWriteError as e:
+            # A concurrent save inserted its active version between our update and insert: retry, last save wins
+            duplicate_active_version = any(error.get("code") == 11000 for error in e.details.get("writeErrors", []))
+            if not duplicate_active_version or attempt == SAVE_CONFLICT_RETRIES:
+                raise
+
 @app.post("/save-verified-document/")
 async def save_verified_document(payload: VerificationPayload):
+    await ensure_database()
     try:
-        await verified_collection.update_many(
-            {"application_id": payload.application_id, "filename": payload.filename, "is_active": True},
-            {"$set": {"is_active": False, "end_date": datetime.now(timezone.utc)}}
-        )
-        
-        new_document_record = {
-            "application_id": payload.application_id,
-            "filename": payload.filename,
-            "ai_data": payload.original_ai_data.get("extracted_data", {}),
-            "verified_data": payload.verified_data,
-            "start_date": datetime.now(timezone.utc),
-            "end_date": None,
-            "is_active": True
-        }
-        
-        result = await verified_collection.insert_one(new_document_record)
-        return {"status": "success", "message": f"Verified data for {payload.filename} saved with ID {result.inserted_id}."}
+        document = VerifiedDocument(filename=payload.filename, original_ai_data=payload.original_ai_data, verified_data=payload.verified_data)
+        inserted_ids = await save_verified_versions(payload.application_id, [document])
+        return {"status": "success", "message": f"Verified data for {payload.filename} saved with ID {inserted_ids[0]}."}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save data to MongoDB: {str(e)}")
+
+@app.post("/save-verified-application/")
+async def save_verified_application(payload: ApplicationVerificationPayload):
+    # Saves the verified data of every document of an application in one round trip
+    if not payload.documents:
+        raise HTTPException(status_code=400, detail="No documents to save.")
+    await ensure_database()
+    try:
+        inserted_ids = await save_verified_versions(payload.application_id, payload.documents)
+        return {"status": "success", "message": f"Verified data for {len(inserted_ids)} documents saved.", "inserted_ids": [str(inserted_id) for inserted_id in inserted_ids]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save data to MongoDB: {str(e)}")
 
 @app.get("/get-report-data/")
 async def get_report_data():
+    await ensure_database()
     try:
         cursor = verified_collection.find({"is_active": True})
         documents = await cursor.to_list(length=None)
@@ -237,8 +1762,130 @@ async def get_report_data():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch report data: {str(e)}")
 
+def mongo_number(field_paths: List[str]) -> dict:
+    # First non-null of the given fields as a number, tolerating "₹1,20,000"-style strings; null if it does not parse
+    value = None
+    for field_path in reversed(field_paths):
+        value = {"$ifNull": [field_path, value]}
+    as_string = {"$convert": {"input": value, "to": "string", "onError": None, "onNull": None}}
+    cleaned = as_string
+    for character in (",", "₹", " "):
+        cleaned = {"$replaceAll": {"input": cleaned, "find": character, "replacement": ""}}
+    return {"$convert": {"input": cleaned, "to": "double", "onError": None, "onNull": None}}
+
+def mongo_normalised_string(value) -> dict:
+    return {"$toLower": {"$trim": {"input": {"$convert": {"input": value, "to": "string", "onError": "", "onNull": ""}}}}}
+
+# Per-field AI accuracy, document count and income/tax averages over active records, in one round trip
+report_kpi_pipeline = [
+    {"$match": {"is_active": True}},
+    {"$facet": {
+        "documents": [{"$count": "total"}],
+        "fields": [
+            {"$project": {
+                "ai_entries": {"$objectToArray": {"$ifNull": ["$ai_data", {}]}},
+                "verified": {"$objectToArray": {"$ifNull": ["$verified_data", {}]}}
+            }},
+            {"$unwind": "$verified"},
+            {"$project": {
+                "field": "$verified.k",
+                "verified_value": "$verified.v",
+                "ai_entry": {"$arrayElemAt": [{"$filter": {"input": "$ai_entries", "cond": {"$eq": ["$$this.k", "$verified.k"]}}}, 0]}
+            }},
+            # AI fields are stored as {"value": ..., "confidence": ...}, verified fields as plain values
+            {"$project": {
+                "field": 1,
+                "verified_value": 1,
+                "ai_value": {"$cond": [{"$eq": [{"$type": "$ai_entry.v"}, "object"]}, "$ai_entry.v.value", "$ai_entry.v"]}
+            }},
+            {"$match": {"ai_value": {"$ne": None}, "verified_value": {"$ne": None}}},
+            {"$group": {
+                "_id": "$field",
+                "compared": {"$sum": 1},
+                "matching": {"$sum": {"$cond": [{"$eq": [mongo_normalised_string("$ai_value"), mongo_normalised_string("$verified_value")]}, 1, 0]}}
+            }},
+            {"$sort": {"_id": 1}}
+        ],
+        "averages": [
+            {"$group": {
+                "_id": None,
+                "average_income": {"$avg": mongo_number(["$verified_data.Gross Income", "$verified_data.Total Income"])},
+                "average_taxes": {"$avg": mongo_number(["$verified_data.Total Taxes", "$verified_data.Taxes Paid"])}
+            }}
+        ]
+    }}
+]
+
+@app.get("/report-kpis/")
+async def get_report_kpis():
+    await ensure_database()
+    try:
+        with stage_span("db_report_kpis"):
+            facets = (await verified_collection.aggregate(report_kpi_pipeline).to_list(length=1))[0]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute report KPIs: {str(e)}")
+
+    per_field = [
+        {"field": row["_id"], "compared": row["compared"], "matching": row["matching"], "accuracy": row["matching"] / row["compared"] * 100}
+        for row in facets["fields"]
+    ]
+    fields_compared = sum(row["compared"] for row in per_field)
+    fields_matching = sum(row["matching"] for row in per_field)
+    averages = facets["averages"][0] if facets["averages"] else {}
+    return {
+        "total_active_documents": facets["documents"][0]["total"] if facets["documents"] else 0,
+        "fields_compared": fields_compared,
+        "fields_matching": fields_matching,
+        "ai_accuracy": fields_matching / fields_compared * 100 if fields_compared else 0.0,
+        "per_field_accuracy": per_field,
+        "average_income": averages.get("average_income"),
+        "average_taxes": averages.get("average_taxes")
+    }
+
+@app.get("/report-history/")
+async def get_report_history(limit: int = 100, after_id: Optional[str] = None, include_inactive: bool = True):
+    # Newest first, keyset-paginated on _id: pass the last _id of a page as after_id to get the next one.
+    # Records are streamed as NDJSON straight from the cursor instead of being collected in memory.
+    await ensure_database()
+    limit = max(1, min(limit, REPORT_HISTORY_MAX_PAGE_SIZE))
+    query = {} if include_inactive else {"is_active": True}
+    if after_id:
+        from bson import ObjectId
+        from bson.errors import InvalidId
+        try:
+            query["_id"] = {"$lt": ObjectId(after_id)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail=f"Invalid after_id: {after_id}")
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"_id": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "application_id": 1, "filename": 1, "is_active": 1, "start_date": 1, "end_date": 1, "verified_data": 1,
+            # Only the AI values are needed for the history table, confidences are dropped server-side
+            "ai_data": {"$arrayToObject": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$ai_data", {}]}},
+                "in": {"k": "$$this.k", "v": {"$cond": [{"$eq": [{"$type": "$$this.v"}, "object"]}, {"$ifNull": ["$$this.v.value", None]}, "$$this.v"]}}
+            }}}
+        }}
+    ]
+
+    async def stream_records():
+        async for doc in verified_collection.aggregate(pipeline, batchSize=limit):
+            doc["_id"] = str(doc["_id"])
+            yield json.dumps(doc, default=str) + "\n"
+
+    return StreamingResponse(stream_records(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format; with several uvicorn workers every process reports its own series
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.delete("/delete-all-data/")
 async def delete_all_data():
+    await ensure_database()
     try:
         await verified_collection.delete_many({})
         return {"status": "success", "message": "All verified data has been deleted from the database."}
@@ -0,0 +1,171 @@
+"""
+Minimal Prometheus metrics and per-application stage spans.
+
+Metrics are kept in process and rendered in the Prometheus text exposition format (version 0.0.4) by the
+API's /metrics endpoint, so each uvicorn worker reports its own series. A span is the duration of one stage
+(rasterising a document, a model call, a database round trip...). Every span is observed in the stage
+histogram, and when an application is being processed it is also added to that application's trace.
+"""
+import abc
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+REGISTRY = []
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        REGISTRY.append(self)
+
+    def label_key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """The sample lines of this metric in the exposition format."""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"] + self.samples()
+
+
+class Counter(Metric):
+    """A monotonically increasing count. With ``collect`` the value is read from elsewhere at scrape time."""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), collect: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, label_names)
+        self.collect = collect
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self.label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        if self.collect is not None:
+            return [f"{self.name} {format_value(self.collect())}"]
+        return [f"{self.name}{format_labels(list(zip(self.label_names, key)))} {format_value(value)}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, usually read with ``collect`` at scrape time."""
+
+    metric_type = "gauge"
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (not cumulative), sum, count]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.label_key(labels)
+        series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                series[0][index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (bucket_counts, total, count) in sorted(self.series.items()):
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', format_value(upper_bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- Stage spans ---
+
+STAGE_SECONDS = Histogram("loan_stage_duration_seconds", "Duration of each processing stage in seconds.", ("stage",))
+
+
+class ApplicationTrace:
+    """The stage spans recorded while one application was processed."""
+
+    def __init__(self, application_id: str):
+        self.application_id = application_id
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage: str, started: float, duration: float, document: Optional[str] = None):
+        self.spans.append({
+            "stage": stage,
+            "document": document,
+            "start_ms": round((started - self.started) * 1000, 1),
+            "duration_ms": round(duration * 1000, 1)
+        })
+
+    def summary(self) -> dict:
+        stages = {}
+        for span in self.spans:
+            stage = stages.setdefault(span["stage"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stage["count"] += 1
+            stage["total_ms"] = round(stage["total_ms"] + span["duration_ms"], 1)
+            stage["max_ms"] = max(stage["max_ms"], span["duration_ms"])
+        return {
+            "application_id": self.application_id,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": stages,
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"])
+        }
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def record_span(stage: str, started: float, duration: float, document: Optional[str] = None):
+    STAGE_SECONDS.observe(duration, stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, started, duration, document)
+
+
+@contextmanager
+def stage_span(stage: str, document: Optional[str] = None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, started, time.perf_counter() - started, document)
@@ -0,0 +1,284 @@
+"""
+Schemas and parsing for the JSON answers of the model.
+
+Every extraction prompt gets a Pydantic model built from the fields it asks for, which is both sent to
+the model as its response schema (JSON mode) and used to validate the answer. Answers are read with a
+tolerant parser that skips markdown fences and surrounding text, drops trailing commas and closes a
+response that was cut off mid-object, so a slightly malformed answer does not cost another call.
+Validation reports which fields failed, so only those need to be asked for again; the analysis block is
+free-form and never fails an answer.
+"""
+import re
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, create_model, field_validator, model_validator
+
+
+class StructuredOutputError(ValueError):
+    """Raised when no JSON object can be recovered from a model answer."""
+
+
+# --- Tolerant JSON parsing ---
+
+def structural_chars(text: str, start: int = 0) -> Iterator[Tuple[int, str]]:
+    """The index and character of everything in ``text`` from ``start`` on that is not inside a JSON string (quotes included)."""
+    in_string = escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        yield index, char
+
+
+def recover_json_text(text: str) -> str:
+    """The first JSON object in ``text``, closed off at its last complete member if the text ends early."""
+    start = text.find("{")
+    if start == -1:
+        raise StructuredOutputError("The answer contains no JSON object.")
+
+    closers = []
+    # Position up to which the text is a valid prefix, and the brackets still open there
+    last_complete = (start + 1, ["}"])
+    for index, char in structural_chars(text, start):
+        if char in "{[":
+            closers.append("}" if char == "{" else "]")
+            last_complete = (index + 1, list(closers))
+        elif char in "}]":
+            if not closers or closers.pop() != char:
+                raise StructuredOutputError(f"Unbalanced '{char}' at position {index}.")
+            if not closers:
+                return text[start:index + 1]
+            last_complete = (index + 1, list(closers))
+        elif char == ",":
+            last_complete = (index, list(closers))
+
+    # Cut off mid-answer: keep everything up to the last complete member and close what is still open
+    end, open_closers = last_complete
+    return text[start:end] + "".join(reversed(open_closers))
+
+
+def strip_trailing_commas(text: str) -> str:
+    # Only commas outside strings are dropped, so a value such as "x, }" is kept as it was
+    trailing = {
+        index for index, char in structural_chars(text)
+        if char == "," and text[index + 1:].lstrip()[:1] in ("}", "]")
+    }
+    return "".join(char for index, char in enumerate(text) if index not in trailing)
+
+
+def loads_tolerant(text: str) -> Any:
+    candidate = recover_json_text(text or "")
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    # Trailing commas are the most common slip
+    try:
+        return json.loads(strip_trailing_commas(candidate))
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"The answer is not valid JSON: {e}") from e
+
+
+# --- Schemas ---
+
+class ExtractedField(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    # Free-form documents return tables (e.g. a statement's transactions) as lists or objects
+    value: Optional[Union[str, int, float, bool, list, dict]]
+    confidence: float = Field(default=0.0, ge=0, le=1)
+
+    @model_validator(mode="before")
+    @classmethod
+    def wrap_bare_value(cls, data):
+        # A bare value instead of {"value", "confidence"} is kept, with no confidence behind it
+        if data is None or isinstance(data, (str, int, float, bool, list)):
+            return {"value": data, "confidence": 0.0}
+        if isinstance(data, dict) and "value" not in data:
+            return {"value": data, "confidence": 0.0}
+        return data
+
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def normalise_confidence(cls, confidence):
+        # "95%" and 95 both mean 0.95, a missing score counts as no confidence
+        if confidence is None:
+            return 0.0
+        if isinstance(confidence, str):
+            confidence = float(confidence.strip().rstrip("%"))
+        if isinstance(confidence, (int, float)) and 1 < confidence <= 100:
+            confidence = confidence / 100
+        return confidence
+
+
+class ExtractionAnalysis(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    red_flags: List[str] = []
+    notes: Optional[str] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def wrap_text(cls, data):
+        if data is None:
+            return {}
+        if isinstance(data, str):
+            return {"notes": data}
+        if isinstance(data, list):
+            return {"red_flags": data}
+        if not isinstance(data, dict):
+            return {"notes": str(data)}
+        return data
+
+    @field_validator("red_flags", mode="before")
+    @classmethod
+    def coerce_red_flags(cls, red_flags):
+        # "None found", a single flag as text, or flags given as objects are all kept as a list of strings
+        if red_flags is None:
+            return []
+        if not isinstance(red_flags, list):
+            red_flags = [red_flags]
+        return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False, default=str) for item in red_flags if item not in (None, "")]
+
+    @field_validator("notes", mode="before")
+    @classmethod
+    def coerce_notes(cls, notes):
+        if notes is None or isinstance(notes, str):
+            return notes
+        if isinstance(notes, list):
+            return "; ".join(item if isinstance(item, str) else json.dumps(item, ensure_ascii=False, default=str) for item in notes)
+        return json.dumps(notes, ensure_ascii=False, default=str)
+
+
+class CrossValidationReport(BaseModel):
+    overall_summary: str
+    validation_passed: bool
+
+
+class FinalSummaryReport(BaseModel):
+    overall_summary: str
+    key_financial_metrics: List[str] = []
+    consolidated_red_flags: List[str] = []
+    final_recommendation: str
+
+
+def prompt_field_names(field_list: str) -> List[str]:
+    # '"Name", "Date of Birth", and "PAN Number"' -> ["Name", "Date of Birth", "PAN Number"]
+    return re.findall(r'"([^"]+)"', field_list)
+
+
+def build_extraction_model(model_name: str, fields: Optional[List[str]] = None, with_document_type: bool = False) -> Type[BaseModel]:
+    """
+    The answer schema of an extraction prompt. With ``fields`` every listed field must be present (its value
+    may be null); without, "extracted_data" is an open mapping of field name to value and confidence.
+    """
+    if fields:
+        # The field names are prompt labels such as "Father's Name", so they are aliases of positional attributes
+        data_model = create_model(
+            f"{model_name}Fields",
+            __config__=ConfigDict(extra="allow", populate_by_name=True),
+            **{f"field_{index}": (Optional[ExtractedField], Field(..., alias=field)) for index, field in enumerate(fields)}
+        )
+    else:
+        data_model = Dict[str, Optional[ExtractedField]]
+
+    attributes = {"extracted_data": (data_model, ...), "analysis": (ExtractionAnalysis, Field(default_factory=ExtractionAnalysis))}
+    if with_document_type:
+        attributes["document_type"] = (str, ...)
+    return create_model(model_name, **attributes)
+
+
+@lru_cache(maxsize=128)
+def field_repair_model(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """The answer schema of a repair call for ``fields``, one class per set of failing fields."""
+    return build_extraction_model("FieldRepair", list(fields))
+
+
+def inline_refs(schema: Any, definitions: dict) -> Any:
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return inline_refs(definitions[schema["$ref"].split("/")[-1]], definitions)
+        return {
+            key: {name: inline_refs(prop, definitions) for name, prop in value.items()} if key == "properties" else inline_refs(value, definitions)
+            for key, value in schema.items() if key not in ("$defs", "title", "default")
+        }
+    if isinstance(schema, list):
+        return [inline_refs(item, definitions) for item in schema]
+    return schema
+
+
+# Bounded, as the keys are classes and repair models are made per set of failing fields
+@lru_cache(maxsize=256)
+def response_json_schema(model: Type[BaseModel]) -> dict:
+    """The JSON schema of ``model`` with references inlined, the form the model API accepts as a response schema."""
+    schema = model.model_json_schema(by_alias=True)
+    return inline_refs(schema, schema.get("$defs", {}))
+
+
+# --- Validation ---
+
+def dump_extraction(validated: BaseModel) -> dict:
+    result = validated.model_dump(by_alias=True)
+    result["extracted_data"] = {
+        field: details if details is not None else {"value": None, "confidence": 0.0}
+        for field, details in (result.get("extracted_data") or {}).items()
+    }
+    return result
+
+
+def validate_extraction(data: Any, model: Type[BaseModel]) -> Tuple[Optional[dict], List[str]]:
+    """
+    Validates a parsed answer against ``model``. Returns the validated result without the fields that failed,
+    and the names of those fields. The result is None when the answer does not have the expected shape at all.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("extracted_data"), dict):
+        return None, []
+    try:
+        return dump_extraction(model.model_validate(data)), []
+    except ValidationError as e:
+        errors = e.errors()
+
+    # Only the extracted fields matter: an analysis block or document type of an unexpected shape is kept as text
+    data = dict(data)
+    failing_fields = []
+    for error in errors:
+        location = error["loc"]
+        if location and location[0] == "analysis":
+            data["analysis"] = {"notes": json.dumps(data.get("analysis"), ensure_ascii=False, default=str)}
+            continue
+        if location and location[0] == "document_type":
+            document_type = data.get("document_type")
+            if isinstance(document_type, list):
+                document_type = document_type[0] if document_type else None
+            data["document_type"] = str(document_type or "Other")
+            continue
+        if len(location) < 2 or location[0] != "extracted_data":
+            return None, []
+        if location[1] not in failing_fields:
+            failing_fields.append(str(location[1]))
+
+    # Missing fields are validated as null, fields with an unusable value are dropped until they are repaired
+    extracted_data = {field: details for field, details in data["extracted_data"].items() if field not in failing_fields}
+    extracted_data.update({field: None for field in failing_fields})
+    try:
+        return dump_extraction(model.model_validate({**data, "extracted_data": extracted_data})), failing_fields
+    except ValidationError:
+        return None, []
+
+
+def parse_model_answer(text: str, model: Type[BaseModel]) -> Optional[dict]:
+    """Parses and validates a whole answer such as a report, or None if it cannot be recovered."""
+    try:
+        return model.model_validate(loads_tolerant(text)).model_dump()
+    except (StructuredOutputError, ValidationError):
+        return None
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_scheduler import CircuitBreaker, CircuitOpenError, LLMScheduler, TokenBucket, is_transient_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeModel:
+    """Plays back ``outcomes`` in order: an exception is raised, anything else is returned."""
+
+    def __init__(self, *outcomes, latency=0.0):
+        self.outcomes = list(outcomes)
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, messages, **options):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+class Message:
+    content = "Classify this document."
+
+
+def scheduler(model, clock, **options):
+    return LLMScheduler(model, requests_per_minute=600, tokens_per_minute=100000, clock=clock, sleep=clock.sleep, **options)
+
+
+def test_token_bucket_refills_with_time():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock, clock.sleep)
+    asyncio.run(bucket.acquire(60))
+    assert bucket.tokens == 0
+    clock.now += 30
+    bucket._refill()
+    assert bucket.tokens == pytest.approx(30)
+    clock.now += 300
+    bucket._refill()
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_waits_for_the_missing_tokens():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock, clock.sleep)
+    asyncio.run(bucket.acquire(60))
+    asyncio.run(bucket.acquire(15))
+    assert clock.now == pytest.approx(1015)
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 10
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+@pytest.mark.parametrize("error, transient", [
+    (StatusError(429), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (asyncio.TimeoutError(), True),
+    (ConnectionError("reset by peer"), True),
+    (Exception("RESOURCE_EXHAUSTED: quota exceeded"), True),
+    (ValueError("invalid argument"), False),
+])
+def test_is_transient_error(error, transient):
+    assert is_transient_error(error) is transient
+
+
+def test_transient_errors_are_retried():
+    clock = FakeClock()
+    model = FakeModel(StatusError(503), StatusError(429), "answer")
+    llm = scheduler(model, clock, max_retries=3)
+    assert asyncio.run(llm.invoke([Message()])) == "answer"
+    assert model.calls == 3
+    assert llm.retries == 2
+    assert llm.breaker.state == "closed"
+
+
+def test_other_errors_are_not_retried():
+    clock = FakeClock()
+    model = FakeModel(StatusError(400), "answer")
+    llm = scheduler(model, clock)
+    with pytest.raises(StatusError):
+        asyncio.run(llm.invoke([Message()]))
+    assert model.calls == 1
+    assert llm.failures == 1
+    assert llm.breaker.consecutive_failures == 0
+
+
+def test_retries_stop_after_max_retries():
+    clock = FakeClock()
+    model = FakeModel(*[StatusError(503)] * 5)
+    llm = scheduler(model, clock, max_retries=2, failure_threshold=10)
+    with pytest.raises(StatusError):
+        asyncio.run(llm.invoke([Message()]))
+    assert model.calls == 3
+
+
+def test_open_breaker_rejects_calls():
+    clock = FakeClock()
+    model = FakeModel(*[StatusError(503)] * 2)
+    llm = scheduler(model, clock, max_retries=5, failure_threshold=2, reset_seconds=30)
+    with pytest.raises(StatusError):
+        asyncio.run(llm.invoke([Message()]))
+    assert model.calls == 2
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(llm.invoke([Message()]))
+    assert llm.rejected == 1
+
+
+def test_timeout_is_one_deadline_for_all_attempts():
+    # A model that never answers in time: the retries must not stretch the call to timeout x (retries + 1)
+    model = FakeModel(*["late answer"] * 4, latency=1.0)
+    llm = LLMScheduler(model, requests_per_minute=600, tokens_per_minute=100000, max_retries=3, base_delay=0.01, failure_threshold=10)
+
+    async def timed_call():
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(asyncio.TimeoutError):
+            await llm.invoke([Message()], timeout=0.2)
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(timed_call()) < 0.5
+    assert model.calls == 1
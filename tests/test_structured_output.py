@@ -0,0 +1,119 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_output import (
+    ExtractedField, StructuredOutputError, build_extraction_model, field_repair_model, loads_tolerant,
+    recover_json_text, response_json_schema, validate_extraction
+)
+
+PAN_MODEL = build_extraction_model("PANCard", ["Name", "PAN Number"])
+DEFAULT_MODEL = build_extraction_model("Default")
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"a": 1}\n```',
+    'Here is the result: {"a": 1} Let me know if you need more.',
+    '{"a": 1,}',
+    '{"a": 1, "b": "cut off mid-va',
+])
+def test_loads_tolerant_recovers_wrapped_and_malformed_json(text):
+    assert loads_tolerant(text) == {"a": 1}
+
+
+def test_loads_tolerant_keeps_commas_inside_strings():
+    assert loads_tolerant('{"a": "x, }",}') == {"a": "x, }"}
+    assert loads_tolerant('{"a": ["1, ]", "2",],}') == {"a": ["1, ]", "2"]}
+
+
+def test_recover_json_text_closes_a_cut_off_answer():
+    assert recover_json_text('{"a": {"b": [1, 2') == '{"a": {"b": [1]}}'
+    assert recover_json_text('{"a": "}", "b": 2} trailing') == '{"a": "}", "b": 2}'
+
+
+def test_loads_tolerant_without_json():
+    with pytest.raises(StructuredOutputError):
+        loads_tolerant("I could not read the document.")
+
+
+@pytest.mark.parametrize("details, expected", [
+    ({"value": "X", "confidence": "95%"}, 0.95),
+    ({"value": "X", "confidence": 90}, 0.9),
+    ({"value": "X", "confidence": None}, 0.0),
+    ({"value": "X"}, 0.0),
+    ("X", 0.0),
+])
+def test_extracted_field_confidence(details, expected):
+    assert ExtractedField.model_validate(details).confidence == pytest.approx(expected)
+
+
+def test_missing_confidence_is_not_a_failing_field():
+    result, failing = validate_extraction({"extracted_data": {"Name": {"value": "Ravi Kumar"}, "PAN Number": {"value": "ABCPK1234F"}}}, PAN_MODEL)
+    assert failing == []
+    assert result["extracted_data"]["Name"] == {"value": "Ravi Kumar", "confidence": 0.0}
+
+
+def test_list_and_object_values_are_kept():
+    transactions = [{"date": "01/04/2024", "amount": 1200.5}, {"date": "02/04/2024", "amount": -300}]
+    result, failing = validate_extraction({"extracted_data": {
+        "Transactions": {"value": transactions, "confidence": 0.8},
+        "Account": {"number": "1234", "ifsc": "HDFC0001"},
+        "Holders": ["Ravi Kumar", "Priya Nair"],
+    }}, DEFAULT_MODEL)
+    assert failing == []
+    assert result["extracted_data"]["Transactions"]["value"] == transactions
+    assert result["extracted_data"]["Account"]["value"] == {"number": "1234", "ifsc": "HDFC0001"}
+    assert result["extracted_data"]["Holders"]["value"] == ["Ravi Kumar", "Priya Nair"]
+
+
+@pytest.mark.parametrize("analysis", [
+    {"red_flags": "None found"},
+    {"red_flags": [{"flag": "Name mismatch", "severity": "high"}]},
+    {"notes": ["blurred photo", "old card"]},
+    "Looks genuine",
+    ["expired"],
+    42,
+])
+def test_malformed_analysis_keeps_the_fields(analysis):
+    data = {"extracted_data": {"Name": {"value": "Ravi Kumar", "confidence": 0.9}, "PAN Number": {"value": "ABCPK1234F", "confidence": 0.9}}, "analysis": analysis}
+    result, failing = validate_extraction(data, PAN_MODEL)
+    assert failing == []
+    assert result["extracted_data"]["PAN Number"]["value"] == "ABCPK1234F"
+    assert all(isinstance(flag, str) for flag in result["analysis"]["red_flags"])
+    assert result["analysis"]["notes"] is None or isinstance(result["analysis"]["notes"], str)
+
+
+def test_invalid_field_is_reported_and_the_rest_kept():
+    data = {"extracted_data": {"Name": {"value": "Ravi Kumar", "confidence": 0.9}, "PAN Number": {"value": "ABCPK1234F", "confidence": 7000}}}
+    result, failing = validate_extraction(data, PAN_MODEL)
+    assert failing == ["PAN Number"]
+    assert result["extracted_data"]["Name"]["value"] == "Ravi Kumar"
+    assert result["extracted_data"]["PAN Number"] == {"value": None, "confidence": 0.0}
+
+
+def test_missing_field_is_reported():
+    result, failing = validate_extraction({"extracted_data": {"Name": {"value": "Ravi Kumar", "confidence": 0.9}}}, PAN_MODEL)
+    assert failing == ["PAN Number"]
+    assert result["extracted_data"]["Name"]["value"] == "Ravi Kumar"
+
+
+@pytest.mark.parametrize("data", [None, [], {"analysis": {}}, {"extracted_data": "none"}])
+def test_unusable_extracted_data(data):
+    assert validate_extraction(data, PAN_MODEL) == (None, [])
+
+
+def test_document_type_of_an_unexpected_shape_is_kept():
+    combined = build_extraction_model("Combined", with_document_type=True)
+    result, failing = validate_extraction({"document_type": ["PAN Card"], "extracted_data": {"Name": "Ravi Kumar"}}, combined)
+    assert failing == []
+    assert isinstance(result["document_type"], str)
+
+
+def test_field_repair_model_is_reused():
+    assert field_repair_model(("Name",)) is field_repair_model(("Name",))
+    schema = response_json_schema(field_repair_model(("Name",)))
+    assert "$defs" not in schema
+    assert schema["properties"]["extracted_data"]["required"] == ["Name"]
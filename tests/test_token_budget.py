@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import TokenBudgetExceeded, build_summary_payloads, estimate_text_tokens, fit_to_token_budget
+
+
+def statement(filename):
+    transactions = [{"date": "01/04/2024", "description": "NEFT transfer " * 15, "amount": 1200.5}] * 50
+    return {"filename": filename, "document_type": "Bank Statement", "extracted_data": {
+        "Account Holder": {"value": "Ravi Kumar", "confidence": 0.9},
+        "Transactions": {"value": transactions, "confidence": 0.8},
+    }}
+
+
+CANDIDATES = build_summary_payloads([statement(f"statement_{i}.pdf") for i in range(5)], {"validation_passed": True})
+
+
+def test_first_candidate_within_budget_is_used():
+    assert fit_to_token_budget(CANDIDATES, estimate_text_tokens(CANDIDATES[0]), "final_summary") == CANDIDATES[0]
+
+
+def test_values_are_truncated_until_the_payload_fits():
+    payload = fit_to_token_budget(CANDIDATES, 1500, "final_summary")
+    assert estimate_text_tokens(payload) <= 1500
+    assert all(f"statement_{i}.pdf" in payload for i in range(5))
+
+
+def test_payload_that_cannot_fit_raises():
+    with pytest.raises(TokenBudgetExceeded):
+        fit_to_token_budget(CANDIDATES, 50, "final_summary")
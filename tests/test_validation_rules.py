@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation_rules import FAIL, PASS, UNDECIDED, check_aadhaar, check_pan, compare_dates, compare_names, find_fields, validate_application
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Ravi Kumar", "RAVI KUMAR"),
+    ("Mr. Ravi Kumar", "Kumar Ravi"),
+    ("R. K. Sharma", "Ravi Kumar Sharma"),
+    ("Mohd Imran", "Mohammed Imran"),
+    ("Lakshmi Devi", "Laxmi Devi"),
+    ("Ravi Shankar Kumar", "Ravi Kumar"),
+])
+def test_compare_names_matches_variants(first, second):
+    assert compare_names(first, second)[0] == PASS
+
+
+def test_compare_names_rejects_different_people():
+    assert compare_names("Ravi Kumar", "Priya Nair")[0] == FAIL
+
+
+def test_compare_names_is_undecided_for_empty_names():
+    assert compare_names("Mr.", "Ravi Kumar")[0] == UNDECIDED
+
+
+@pytest.mark.parametrize("first, second", [
+    ("14/08/1990", "1990-08-14"),
+    ("14 Aug 1990", "14-08-1990"),
+    ("August 14th, 1990", "14.08.1990"),
+    ("15/08/65", "15/08/1965"),
+    ("15-08-05", "15/08/2005"),
+    ("1990", "14/08/1990"),
+])
+def test_compare_dates_matches_formats(first, second):
+    assert compare_dates(first, second)[0] == PASS
+
+
+def test_compare_dates_day_month_swap_is_undecided():
+    assert compare_dates("04/08/1990", "08/04/1990")[0] == UNDECIDED
+
+
+def test_compare_dates_rejects_different_dates():
+    assert compare_dates("14/08/1990", "15/08/1991")[0] == FAIL
+    assert compare_dates("not a date", "14/08/1990")[0] == UNDECIDED
+
+
+@pytest.mark.parametrize("value, status", [
+    ("ABCPK1234F", PASS),
+    ("abcpk 1234f", PASS),
+    ("ABCCK1234F", FAIL),
+    ("ABCP1234F", FAIL),
+])
+def test_check_pan(value, status):
+    assert check_pan(value)[0] == status
+
+
+@pytest.mark.parametrize("value, status", [
+    ("2345 6789 0124", PASS),
+    ("XXXX XXXX 0124", PASS),
+    ("2345 6789 0125", FAIL),
+    ("1345 6789 0124", FAIL),
+    ("2345 6789 012", FAIL),
+])
+def test_check_aadhaar(value, status):
+    assert check_aadhaar(value)[0] == status
+
+
+def test_find_fields_skips_other_people():
+    extracted_data = {
+        "Employee Name": {"value": "Ravi Kumar"},
+        "Father's Name": {"value": "S K Kumar"},
+        "Employer PAN": {"value": "AAACX1234F"},
+        "PAN of the Deductor": {"value": "AAACX1234F"},
+        "PAN of the Employee": {"value": "ABCPK1234F"},
+    }
+    assert find_fields(extracted_data, "name") == ["Ravi Kumar"]
+    assert find_fields(extracted_data, "pan") == ["ABCPK1234F"]
+
+
+def document(filename, document_type, **fields):
+    return {"filename": filename, "document_type": document_type, "extracted_data": {field: {"value": value} for field, value in fields.items()}}
+
+
+def test_validate_application_passes_consistent_documents():
+    report = validate_application([
+        document("pan.png", "PAN Card", **{"Name": "Ravi Kumar", "Date of Birth": "14/08/1990", "PAN Number": "ABCPK1234F"}),
+        document("aadhaar.png", "Aadhaar Card", **{"Name": "KUMAR RAVI", "DOB": "14-08-1990", "Aadhaar Number": "2345 6789 0124"}),
+        document("payslip.pdf", "Payslip", **{"Employee Name": "Ravi Kumar", "Employer PAN": "AAACX1234F"}),
+    ])
+    assert report["validation_passed"] is True
+    assert report["undecided"] == []
+    assert all(check["status"] == PASS for check in report["checks"])
+
+
+def test_validate_application_reports_mismatches_and_undecided():
+    report = validate_application([
+        document("pan.png", "PAN Card", **{"Name": "Ravi Kumar", "Date of Birth": "04/08/1990"}),
+        document("aadhaar.png", "Aadhaar Card", **{"Name": "Priya Nair", "DOB": "08/04/1990"}),
+    ])
+    assert report["validation_passed"] is False
+    assert [check["check"] for check in report["checks"] if check["status"] == FAIL] == ["name_match"]
+    assert [check["check"] for check in report["undecided"]] == ["date_of_birth_match"]
+    assert report["overall_summary"].startswith("Inconsistencies found")
+
+
+def test_validate_application_without_shared_fields():
+    report = validate_application([document("payslip.pdf", "Payslip", **{"Net Pay": "50000"})])
+    assert report["checks"] == []
+    assert report["validation_passed"] is True
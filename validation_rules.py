@@ -0,0 +1,257 @@
+"""
+Deterministic cross-validation of the data extracted from every document of a loan application.
+
+Names are compared after normalising case, punctuation, honorifics, initials, word order and common
+transliteration variants; dates of birth after parsing the usual Indian formats; PAN and Aadhaar numbers
+are checked for format (and the Aadhaar Verhoeff checksum). The report has the same "overall_summary" /
+"validation_passed" shape as the model's cross-validation answer. Comparisons the rules cannot settle
+either way are returned under "undecided" so only those need to go to the model.
+"""
+import re
+import unicodedata
+from datetime import date, datetime
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+PASS, FAIL, UNDECIDED = "pass", "fail", "undecided"
+
+# Fuzzy similarity of two normalised names: at or above MATCH is the same name, at or below MISMATCH a different one
+NAME_MATCH_RATIO = 0.9
+NAME_MISMATCH_RATIO = 0.6
+
+HONORIFICS = {"mr", "mrs", "ms", "miss", "dr", "shri", "sri", "shree", "smt", "kumari", "km", "late", "master"}
+NAME_ALIASES = {
+    "mohd": "mohammad", "md": "mohammad", "mohammed": "mohammad", "muhammad": "mohammad", "muhammed": "mohammad",
+    "kr": "kumar", "kum": "kumar",
+}
+# Applied in order to every name token, so "Shreekant"/"Srikant" or "Lakshmi"/"Laxmi" reduce to the same key
+TRANSLITERATION_RULES = [
+    ("ksh", "x"), ("aa", "a"), ("ee", "i"), ("ii", "i"), ("oo", "u"), ("uu", "u"),
+    ("th", "t"), ("dh", "d"), ("bh", "b"), ("kh", "k"), ("gh", "g"), ("ch", "c"), ("jh", "j"),
+    ("ph", "f"), ("sh", "s"), ("w", "v"), ("z", "j"), ("q", "k"), ("y", "i"),
+]
+# Fields that name, or identify, someone other than the applicant (a Form 16's deductor is the employer)
+OTHER_PERSON_MARKERS = ("father", "mother", "spouse", "husband", "wife", "guardian", "employer", "deductor", "company", "bank", "branch", "nominee")
+
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%Y/%m/%d", "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%b %d, %Y", "%B %d, %Y", "%d%m%Y", "%d/%m/%y", "%d-%m-%y"]
+
+PAN_PATTERN = re.compile(r"^[A-Z]{5}[0-9]{4}[A-Z]$")
+AADHAAR_MASK_PATTERN = re.compile(r"^[X*]{4}\s?[X*]{4}\s?\d{4}$", re.IGNORECASE)
+
+VERHOEFF_MULTIPLICATION = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 0, 6, 7, 8, 9, 5], [2, 3, 4, 0, 1, 7, 8, 9, 5, 6],
+    [3, 4, 0, 1, 2, 8, 9, 5, 6, 7], [4, 0, 1, 2, 3, 9, 5, 6, 7, 8], [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2], [7, 6, 5, 9, 8, 2, 1, 0, 4, 3], [8, 7, 6, 5, 9, 3, 2, 1, 0, 4],
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+VERHOEFF_PERMUTATION = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 5, 7, 6, 2, 8, 3, 0, 9, 4], [5, 8, 0, 3, 7, 9, 6, 1, 4, 2],
+    [8, 9, 1, 6, 0, 4, 3, 5, 2, 7], [9, 4, 5, 3, 1, 2, 6, 8, 7, 0], [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5], [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+
+
+# --- Field lookup ---
+
+def field_value(details) -> Optional[str]:
+    value = details.get("value") if isinstance(details, dict) else details
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def find_fields(extracted_data: Optional[dict], kind: str) -> List[str]:
+    """Values of the applicant's name / date of birth / PAN / Aadhaar fields, whatever the document type called them."""
+    values = []
+    for field, details in (extracted_data or {}).items():
+        key = field.lower()
+        other_person = any(marker in key for marker in OTHER_PERSON_MARKERS)
+        if kind == "name":
+            matches = "name" in key and not other_person
+        elif kind == "date_of_birth":
+            matches = "birth" in key or key in ("dob", "d.o.b", "d.o.b.")
+        elif kind == "pan":
+            matches = "pan" in key and not other_person
+        else:
+            matches = "aadhaar" in key or "aadhar" in key or key in ("uid", "uid number")
+        value = field_value(details)
+        if matches and value:
+            values.append(value)
+    return values
+
+
+# --- Names ---
+
+def name_tokens(name: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    text = re.sub(r"[^a-z\s]", " ", text)
+    tokens = []
+    for token in text.split():
+        if token in HONORIFICS:
+            continue
+        token = NAME_ALIASES.get(token, token)
+        if len(token) > 1:
+            for source, target in TRANSLITERATION_RULES:
+                token = token.replace(source, target)
+            token = re.sub(r"(.)\1+", r"\1", token)
+        tokens.append(token)
+    return tokens
+
+
+def compare_names(first: str, second: str) -> tuple:
+    first_tokens, second_tokens = name_tokens(first), name_tokens(second)
+    if not first_tokens or not second_tokens:
+        return UNDECIDED, "One of the names is empty after normalisation."
+    if sorted(first_tokens) == sorted(second_tokens):
+        return PASS, "Names match after normalising case, punctuation, honorifics, word order and spelling variants."
+
+    # Initials: every single letter must be the first letter of an unmatched full token on the other side
+    first_full = [t for t in first_tokens if len(t) > 1]
+    second_full = [t for t in second_tokens if len(t) > 1]
+    first_initials = [t for t in first_tokens if len(t) == 1]
+    second_initials = [t for t in second_tokens if len(t) == 1]
+    if first_initials or second_initials:
+        shorter_full, longer_full = (first_full, second_full) if len(first_full) <= len(second_full) else (second_full, first_full)
+        initials = first_initials if shorter_full is first_full else second_initials
+        remaining = list(longer_full)
+        if shorter_full and all(token in remaining for token in shorter_full):
+            for token in shorter_full:
+                remaining.remove(token)
+            if sorted(initials) == sorted(token[0] for token in remaining):
+                return PASS, "Names match once initials are expanded."
+
+    common = set(first_tokens) & set(second_tokens)
+    shorter, longer = sorted((first_tokens, second_tokens), key=len)
+    if len(common) >= 2 and set(shorter) <= set(longer) and shorter[0] == longer[0] and shorter[-1] == longer[-1]:
+        return PASS, "Names match apart from a middle name present on only one document."
+
+    ratio = SequenceMatcher(None, " ".join(sorted(first_tokens)), " ".join(sorted(second_tokens))).ratio()
+    if ratio >= NAME_MATCH_RATIO:
+        return PASS, f"Names are near-identical (similarity {ratio:.2f})."
+    if ratio <= NAME_MISMATCH_RATIO and not common:
+        return FAIL, f"Names do not match (similarity {ratio:.2f})."
+    return UNDECIDED, f"Names are partially similar (similarity {ratio:.2f})."
+
+
+# --- Dates ---
+
+def parse_date(value: str):
+    """A date, a bare year (int) for "Year of Birth"-style values, or None if it cannot be parsed."""
+    text = re.sub(r"\s*,\s*", ", ", value.strip())
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", re.sub(r"\s+", " ", text))
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+        # strptime reads two-digit years 00-68 as 20xx, but a date of birth cannot be in the future
+        if "%y" in date_format and parsed > date.today():
+            parsed = parsed.replace(year=parsed.year - 100)
+        return parsed
+    year = re.fullmatch(r"(?:year of birth\s*:?\s*)?((?:19|20)\d{2})", text.lower())
+    return int(year.group(1)) if year else None
+
+
+def compare_dates(first: str, second: str) -> tuple:
+    first_date, second_date = parse_date(first), parse_date(second)
+    if first_date is None or second_date is None:
+        return UNDECIDED, "One of the dates could not be parsed."
+    if isinstance(first_date, int) or isinstance(second_date, int):
+        first_year = first_date if isinstance(first_date, int) else first_date.year
+        second_year = second_date if isinstance(second_date, int) else second_date.year
+        return (PASS, "Years of birth match.") if first_year == second_year else (FAIL, "Years of birth differ.")
+    if first_date == second_date:
+        return PASS, "Dates of birth match."
+    if first_date.day <= 12 and first_date.month <= 12 and (first_date.day, first_date.month) == (second_date.month, second_date.day) and first_date.year == second_date.year:
+        return UNDECIDED, "Dates differ only by a day/month swap, possibly a format difference."
+    return FAIL, "Dates of birth differ."
+
+
+# --- Identifiers ---
+
+def verhoeff_valid(number: str) -> bool:
+    checksum = 0
+    for position, digit in enumerate(reversed(number)):
+        checksum = VERHOEFF_MULTIPLICATION[checksum][VERHOEFF_PERMUTATION[position % 8][int(digit)]]
+    return checksum == 0
+
+
+def check_pan(value: str) -> tuple:
+    pan = re.sub(r"\s", "", value).upper()
+    if not PAN_PATTERN.match(pan):
+        return FAIL, f"PAN '{value}' is not in the AAAAA9999A format."
+    if pan[3] != "P":
+        return FAIL, f"PAN '{value}' does not belong to an individual (4th character is '{pan[3]}', expected 'P')."
+    return PASS, "PAN format is valid."
+
+
+def check_aadhaar(value: str) -> tuple:
+    if AADHAAR_MASK_PATTERN.match(value.strip()):
+        return PASS, "Aadhaar number is masked, only the last four digits are shown."
+    digits = re.sub(r"[\s-]", "", value)
+    if not re.fullmatch(r"\d{12}", digits):
+        return FAIL, f"Aadhaar number '{value}' is not 12 digits."
+    if digits[0] in "01":
+        return FAIL, f"Aadhaar number '{value}' cannot start with 0 or 1."
+    if not verhoeff_valid(digits):
+        return FAIL, f"Aadhaar number '{value}' fails the Verhoeff checksum."
+    return PASS, "Aadhaar number format and checksum are valid."
+
+
+# --- Application report ---
+
+IDENTITY_DOCUMENT_PRIORITY = ["PAN Card", "Aadhaar Card", "Driving License"]
+
+
+def label(document: dict) -> str:
+    return f"{document.get('filename')} ({document.get('document_type')})"
+
+
+def cross_document_checks(documents: List[dict], kind: str, compare) -> List[dict]:
+    # Every document is compared against one reference value, taken from the most authoritative ID document
+    entries = [(document, value) for document in documents for value in find_fields(document.get("extracted_data"), kind)[:1]]
+    if len(entries) < 2:
+        return []
+    entries.sort(key=lambda entry: IDENTITY_DOCUMENT_PRIORITY.index(entry[0].get("document_type")) if entry[0].get("document_type") in IDENTITY_DOCUMENT_PRIORITY else len(IDENTITY_DOCUMENT_PRIORITY))
+    (reference_document, reference_value), others = entries[0], entries[1:]
+    checks = []
+    for document, value in others:
+        status, detail = compare(reference_value, value)
+        checks.append({
+            "check": f"{kind}_match",
+            "status": status,
+            "values": {label(reference_document): reference_value, label(document): value},
+            "detail": detail
+        })
+    return checks
+
+
+def validate_application(documents: List[dict]) -> dict:
+    checks = cross_document_checks(documents, "name", compare_names) + cross_document_checks(documents, "date_of_birth", compare_dates)
+    for document in documents:
+        for kind, check in (("pan", check_pan), ("aadhaar", check_aadhaar)):
+            for value in find_fields(document.get("extracted_data"), kind):
+                status, detail = check(value)
+                checks.append({"check": f"{kind}_format", "status": status, "values": {label(document): value}, "detail": detail})
+
+    failures = [check for check in checks if check["status"] == FAIL]
+    undecided = [check for check in checks if check["status"] == UNDECIDED]
+    if failures:
+        summary = "Inconsistencies found: " + " ".join(f"{check['detail']} ({', '.join(f'{k}: {v}' for k, v in check['values'].items())})" for check in failures)
+        if undecided:
+            summary += f" {len(undecided)} further comparison(s) need manual review."
+    elif undecided:
+        summary = f"No inconsistencies found by the automated checks, {len(undecided)} comparison(s) could not be decided."
+    elif checks:
+        summary = f"All {len(checks)} automated identity checks passed: applicant name, date of birth and ID numbers are consistent."
+    else:
+        summary = "No identity fields were found in more than one document, nothing to cross-check."
+
+    return {
+        "overall_summary": summary,
+        "validation_passed": not failures and not undecided,
+        "checks": checks,
+        "undecided": undecided,
+        "decided_by": "rules"
+    }